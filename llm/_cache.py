@@ -0,0 +1,73 @@
+"""
+On-disk, content-addressed cache for LLM extraction results.
+
+Why: supplier emails often repeat (forwarded threads, boilerplate, the same rate
+sheet attached day after day). Identical input → identical rows, so we skip the
+Gemini call when we have seen the exact text before.
+
+Key:
+- blake2b(model name + prompt templates + provider_hint + text), 16-byte digest.
+  The templates are all that can produce an entry (single and batch prompts), so
+  changing the model or any of them invalidates old entries.
+
+Storage:
+- diskcache.Cache in LLM_CACHE_DIR (default logs/llm_cache), LRU eviction bounded
+  by LLM_CACHE_SIZE_MB (default 256).
+- If diskcache is not installed or LLM_CACHE=false, every lookup is a miss and
+  nothing is stored.
+"""
+
+import os
+import hashlib
+from typing import Dict, List, Optional
+
+try:
+    import diskcache
+except ImportError:
+    diskcache = None
+
+CACHE_DIR = os.getenv("LLM_CACHE_DIR", "logs/llm_cache")
+_SIZE_LIMIT = int(os.getenv("LLM_CACHE_SIZE_MB", "256")) * 1024 * 1024
+
+_cache = None
+
+
+def _enabled() -> bool:
+    return diskcache is not None and os.getenv("LLM_CACHE", "true").lower() in ("1", "true", "yes")
+
+
+def _get_cache():
+    global _cache
+    if not _enabled():
+        return None
+    if _cache is None:
+        _cache = diskcache.Cache(CACHE_DIR, size_limit=_SIZE_LIMIT, eviction_policy="least-recently-used")
+    return _cache
+
+
+def make_key(model_name: str, prompt_template: str, provider_hint: Optional[str], text: str) -> str:
+    h = hashlib.blake2b(digest_size=16)
+    for part in (model_name, prompt_template, provider_hint or "", text):
+        h.update(part.encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def lookup(key: str) -> Optional[List[Dict]]:
+    cache = _get_cache()
+    if cache is None:
+        return None
+    try:
+        return cache.get(key)
+    except Exception:
+        return None  # trasig cache ska aldrig stoppa körningen
+
+
+def store(key: str, rows: List[Dict]) -> None:
+    cache = _get_cache()
+    if cache is None:
+        return
+    try:
+        cache.set(key, rows)
+    except Exception as e:
+        print(f"⚠️ Kunde inte spara i LLM-cachen: {e}")
@@ -9,6 +9,8 @@ extracted from PDF/DOCX). Two modes:
 Env:
 - GOOGLE_API_KEY (required when MOCK_LLM=false)
 - MOCK_LLM (true/false)
+- USE_BATCH_LLM (true/false), BATCH_LLM_POLL_SECONDS, BATCH_LLM_TIMEOUT_SECONDS
+- LLM_CACHE (true/false), LLM_CACHE_DIR, LLM_CACHE_SIZE_MB
 
 Input:
 - A plain-text string (email body or text block).
@@ -28,6 +30,21 @@ Output:
     "variation": "increase" | "decrease" | "unchanged" | "new" | None
   }
 
+Batch:
+- extract_sms_prices_llm_batch([(provider_hint, text), ...]) packs several texts
+  into one prompt ("--- ITEM [i] ---" sections) and routes the returned
+  [{"index": i, "rows": [...]}] back per text. Items missing from the answer are
+  retried one by one.
+
+Async Batch API (USE_BATCH_LLM=true, needs google-genai):
+- submit_batch(prompts, custom_ids) uploads a JSONL file and starts one batch job;
+  poll_batch(job_id) waits for it and returns {custom_id: raw text}.
+- extract_sms_prices_llm_batch_job(items, custom_ids) wires both together.
+
+Cache (llm/_cache.py):
+- Gemini results are cached on disk by hash of (model, prompt, provider_hint, text),
+  so repeated bodies/attachments skip the API call. Not used in MOCK_LLM mode.
+
 Notes:
 - The function is tolerant to number formats (comma/period, currency symbols).
 - If the model returns markdown with ```json blocks, we strip and parse the JSON.
@@ -37,13 +54,37 @@ Notes:
 import os
 import re
 import json
-from typing import List, Dict, Optional
+import time
+import tempfile
+from typing import List, Dict, Optional, Tuple
 from dotenv import load_dotenv
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Hyperscan (SIMD multi-mönster) – valfritt förfilter för mock-parsern
+try:
+    import hyperscan
+except ImportError:
+    hyperscan = None
+
 # Produktions-LLM (Gemini) – används endast om MOCK_LLM=false
 import google.generativeai as genai
 
-from .prompt_templates import PRICE_EXTRACTION_PROMPT
+# Asynkron Batch API (google-genai) – används endast om USE_BATCH_LLM=true
+try:
+    from google import genai as genai_batch
+except ImportError:
+    genai_batch = None
+
+from . import _cache as llm_cache
+from .prompt_templates import (
+    PRICE_EXTRACTION_PROMPT,
+    BATCH_PRICE_EXTRACTION_PROMPT,
+    BATCH_ITEM_TEMPLATE,
+)
 
 load_dotenv()
 genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
@@ -51,6 +92,22 @@ genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
 _MODEL_NAME = "gemini-1.5-flash"
 _MOCK_LLM = os.getenv("MOCK_LLM", "false").lower() in ("1", "true", "yes")
 
+_BATCH_POLL_SECONDS = int(os.getenv("BATCH_LLM_POLL_SECONDS", "60"))
+_BATCH_TIMEOUT_SECONDS = int(os.getenv("BATCH_LLM_TIMEOUT_SECONDS", str(24 * 3600)))
+_BATCH_DONE_STATES = {
+    "JOB_STATE_SUCCEEDED", "JOB_STATE_PARTIALLY_SUCCEEDED",
+    "JOB_STATE_FAILED", "JOB_STATE_CANCELLED", "JOB_STATE_EXPIRED",
+}
+
+
+def _json_loads(s: str):
+    if orjson is not None:
+        try:
+            return orjson.loads(s.encode("utf-8"))
+        except orjson.JSONDecodeError:
+            pass  # t.ex. NaN/Infinity i modellsvaret – stdlib accepterar dem
+    return json.loads(s)
+
 
 def _first_json(text: str) -> Optional[str]:
     m = re.search(r"```(?:json)?\s*(\{.*?\}|\[.*?\])\s*```", text, flags=re.S)
@@ -60,17 +117,30 @@ def _first_json(text: str) -> Optional[str]:
     return m2.group(1) if m2 else None
 
 
+class _NumTable(dict):
+    """Översättningstabell för str.translate: tecken som inte finns i tabellen tas bort."""
+
+    def __missing__(self, key):
+        self[key] = None
+        return None
+
+
+_NUM_TBL = _NumTable({ord(c): ord(c) for c in "0123456789.-"})
+_NUM_TBL[ord(",")] = ord(".")
+
+
 def _to_float(x) -> Optional[float]:
     if x is None:
         return None
     if isinstance(x, (int, float)):
         return float(x)
     s = str(x)
-    s = s.replace("€", "").replace("$", "").replace("£", "")
-    s = s.replace("\u00a0", " ").strip()
-    s = s.replace(",", ".")
-    s = re.sub(r"[A-Za-z]", "", s)
-    s = re.sub(r"[^0-9.\-]", "", s)
+    # snabbväg: redan rent tal ("0.0305", "-1.5") – hoppa över städningen nedan
+    digits = s[1:] if s[:1] == "-" else s
+    if s.isascii() and digits.replace(".", "", 1).isdigit():
+        return float(s)
+    # ett svep: behåll 0-9 . -, gör , till . och ta bort allt annat (valuta, bokstäver, space)
+    s = s.translate(_NUM_TBL)
     if s in ("", ".", "-"):
         return None
     try:
@@ -115,6 +185,54 @@ _OLD_RE = re.compile(r"\b(old price|previous rate|old rate|current rate)\b\D{0,1
 _NEW_RE = re.compile(r"\b(new price|rate)\b\D{0,10}([0-9][0-9.,]*)", re.I)
 _CHG_RE = re.compile(r"\b(increase|decrease|unchanged|up|down|new)\b", re.I)
 _DATE_RE = re.compile(r"\b(20\d{2}[-/]\d{2}[-/]\d{2}(?:[ T]\d{2}:\d{2}(?::\d{2})?)?)\b")
+_SOLO_RE = re.compile(r"\b(rate|price)\b\D{0,10}([0-9][0-9.,]*)", re.I)
+_BLOCK_SPLIT = re.compile(r"\n{2,}")
+
+# Prisindikatorerna (_OLD_RE/_NEW_RE/_SOLO_RE) utan fångstgrupper, för Hyperscan.
+# Hyperscan fångar inget – den används bara för att snabbt sålla bort block utan
+# pris innan Python-regexarna körs. Används bara på ASCII-block: där ger ASCII-\b
+# och kodpunkts-\D minst samma träffar som Pythons varianter. Pythons re.I matchar
+# även t.ex. 'ı', 'ſ' och Kelvin-tecknet mot ASCII-bokstäverna, vilket Hyperscans
+# CASELESS inte gör – övriga block går därför direkt till regexarna.
+_HS_PRICE_PATTERNS = (
+    rb"\b(?:old price|previous rate|old rate|current rate)\b\D{0,10}[0-9]",
+    rb"\b(?:new price|rate)\b\D{0,10}[0-9]",
+    rb"\b(?:rate|price)\b\D{0,10}[0-9]",
+)
+
+
+def _compile_hs_price_db():
+    if hyperscan is None:
+        return None
+    flags = hyperscan.HS_FLAG_CASELESS | hyperscan.HS_FLAG_UTF8 | hyperscan.HS_FLAG_SINGLEMATCH
+    try:
+        db = hyperscan.Database()
+        db.compile(
+            expressions=list(_HS_PRICE_PATTERNS),
+            ids=list(range(len(_HS_PRICE_PATTERNS))),
+            elements=len(_HS_PRICE_PATTERNS),
+            flags=[flags] * len(_HS_PRICE_PATTERNS),
+        )
+        return db
+    except Exception as e:
+        print(f"⚠️ Hyperscan kunde inte kompilera mönstren ({e}) – kör utan förfilter")
+        return None
+
+
+_HS_PRICE_DB = _compile_hs_price_db()
+HAS_HYPERSCAN = _HS_PRICE_DB is not None
+
+
+def _hs_stop(*_args) -> bool:
+    return True  # första träffen räcker – avbryt skanningen
+
+
+def _hs_has_price(block: str) -> bool:
+    try:
+        _HS_PRICE_DB.scan(block.encode("utf-8"), match_event_handler=_hs_stop)
+    except hyperscan.ScanTerminated:
+        return True
+    return False
 
 
 def _rule_based_extract(email_text: str, provider_hint: Optional[str]) -> List[Dict]:
@@ -123,62 +241,83 @@ def _rule_based_extract(email_text: str, provider_hint: Optional[str]) -> List[D
     Skapar 1 rad per stycke/rad där minst pris hittas.
     """
     rows: List[Dict] = []
+    rows_append = rows.append
+    to_float = _to_float
+    normalize = _normalize_record
+    hs_filter = _hs_has_price if HAS_HYPERSCAN else None
+
+    # lokala alias för regex-sökningarna (körs per block)
+    old_search = _OLD_RE.search
+    new_search = _NEW_RE.search
+    solo_search = _SOLO_RE.search
+    country_search = _COUNTRY_RE.search
+    operator_search = _OPERATOR_RE.search
+    mcc_search = _MCC_RE.search
+    mnc_search = _MNC_RE.search
+    cur_search = _CUR_RE.search
+    chg_search = _CHG_RE.search
+    date_search = _DATE_RE.search
 
     # dela upp i stycken för “en rad per block”
-    blocks = [b.strip() for b in re.split(r"\n{2,}", email_text) if b.strip()]
+    blocks = [b.strip() for b in _BLOCK_SPLIT.split(email_text) if b.strip()]
 
     for block in blocks:
+        # förfilter: ett nativt svep avgör om blocket alls kan innehålla ett pris
+        if hs_filter is not None and block.isascii() and not hs_filter(block):
+            continue
+
         # hitta prisindikatorer i blocket
-        old_match = _OLD_RE.search(block)
-        new_match = _NEW_RE.search(block)
+        old_match = old_search(block)
+        new_match = new_search(block)
 
-        if not (old_match or new_match):
-            # försök fall: ensamma "Rate(EUR) 0.123" eller "Price 0.12"
-            solo = re.search(r"\b(rate|price)\b\D{0,10}([0-9][0-9.,]*)", block, re.I)
-            if not solo:
-                continue
+        # försök fall: ensamma "Rate(EUR) 0.123" eller "Price 0.12"
+        # (behövs bara när _NEW_RE inte gav något; sökningen görs högst en gång)
+        solo = solo_search(block) if new_match is None else None
+        if not (old_match or new_match or solo):
+            continue
 
         country = None
-        country_m = _COUNTRY_RE.search(block)
+        country_m = country_search(block)
         if country_m:
             country = country_m.group(1).strip()
 
         operator = None
-        op_m = _OPERATOR_RE.search(block)
+        op_m = operator_search(block)
         if op_m:
             operator = op_m.group(2).strip()
 
         mcc = None
         mnc = None
-        mcc_m = _MCC_RE.search(block)
+        mcc_m = mcc_search(block)
         if mcc_m:
             mcc = mcc_m.group(1)
-        mnc_m = _MNC_RE.search(block)
+        mnc_m = mnc_search(block)
         if mnc_m:
             mnc = mnc_m.group(1)
 
         currency = None
-        cur_m = _CUR_RE.search(block)
+        cur_m = cur_search(block)
         if cur_m:
             currency = cur_m.group(1).upper()
 
         variation = None
-        chg_m = _CHG_RE.search(block)
+        chg_m = chg_search(block)
         if chg_m:
             variation = chg_m.group(1)
 
         eff = None
-        d_m = _DATE_RE.search(block)
+        d_m = date_search(block)
         if d_m:
             eff = d_m.group(1).replace("/", "-")
 
         # priser
-        old_val = _to_float(old_match.group(2)) if old_match else None
-        new_val = _to_float(new_match.group(2)) if new_match else None
+        old_val = to_float(old_match.group(2)) if old_match else None
+        new_val = to_float(new_match.group(2)) if new_match else None
         if new_val is None:
-            solo = re.search(r"\b(rate|price)\b\D{0,10}([0-9][0-9.,]*)", block, re.I)
+            if solo is None and new_match is not None:
+                solo = solo_search(block)
             if solo:
-                new_val = _to_float(solo.group(2))
+                new_val = to_float(solo.group(2))
 
         row = {
             "provider": (provider_hint or None),
@@ -206,12 +345,97 @@ def _rule_based_extract(email_text: str, provider_hint: Optional[str]) -> List[D
             "product_category": None,
             "notes": None
         }
-        rows.append(_normalize_record(row))
+        rows_append(normalize(row))
 
     return rows
 
 
-# ---------------- Publika funktionen ----------------
+# ---------------- Gemini-svar ----------------
+def _rows_from_json(data) -> List[Dict]:
+    if isinstance(data, dict):
+        data = [data]
+    if not isinstance(data, list):
+        return []
+    return [_normalize_record(r) for r in data if isinstance(r, dict)]
+
+
+def _parse_batch_response(raw: str, n_items: int) -> Dict[int, List[Dict]]:
+    """
+    Tolkar svaret på BATCH_PRICE_EXTRACTION_PROMPT:
+      [{"index": i, "rows": [...]}, ...]  ->  {i: [normaliserade rader]}
+    Index som saknas (eller ligger utanför 0..n_items-1) tas inte med.
+    """
+    json_str = _first_json(raw) or raw
+    data = _json_loads(json_str)
+    if isinstance(data, dict):
+        data = [data]
+    if not isinstance(data, list):
+        return {}
+
+    out: Dict[int, List[Dict]] = {}
+    for entry in data:
+        if not isinstance(entry, dict):
+            continue
+        idx = entry.get("index")
+        if isinstance(idx, str) and idx.strip().isdigit():
+            idx = int(idx)
+        if not isinstance(idx, int) or not 0 <= idx < n_items:
+            continue
+        out.setdefault(idx, []).extend(_rows_from_json(entry.get("rows") or []))
+    return out
+
+
+# Cachen delas av enkel- och batchvägen, så nyckeln täcker alla mallar som kan ge ett svar
+_PROMPT_TEMPLATES = "\0".join((PRICE_EXTRACTION_PROMPT, BATCH_PRICE_EXTRACTION_PROMPT, BATCH_ITEM_TEMPLATE))
+
+
+def _cache_key(text: str, provider_hint: Optional[str]) -> str:
+    return llm_cache.make_key(_MODEL_NAME, _PROMPT_TEMPLATES, provider_hint, text)
+
+
+def _cached_or_todo(items: List[Tuple[Optional[str], str]], results: List[List[Dict]]) -> List[int]:
+    """Fyll results med cacheträffar; returnera index för icke-tomma texter som saknas i cachen."""
+    todo = []
+    for i, (hint, text) in enumerate(items):
+        if not text or not text.strip():
+            continue  # tomma texter skickas aldrig till modellen
+        cached = llm_cache.lookup(_cache_key(text, hint))
+        if cached is None:
+            todo.append(i)
+        else:
+            results[i] = cached
+    return todo
+
+
+def _extract_chunk_gemini(model, chunk: List[Tuple[Optional[str], str]]) -> List[List[Dict]]:
+    """
+    Ett Gemini-anrop för hela chunken. Poster som saknas i svaret (eller hela
+    chunken vid parsningsfel) körs om en och en via extract_sms_prices_llm.
+    """
+    items_text = "\n".join(
+        BATCH_ITEM_TEMPLATE.format(index=i, provider_hint=(hint or ""), text=text.strip())
+        for i, (hint, text) in enumerate(chunk)
+    )
+    prompt = BATCH_PRICE_EXTRACTION_PROMPT.format(items=items_text)
+
+    by_index: Dict[int, List[Dict]] = {}
+    try:
+        resp = model.generate_content(prompt)
+        by_index = _parse_batch_response((resp.text or "").strip(), len(chunk))
+    except Exception as e:
+        print(f"❌ LLM/parsningsfel (batch om {len(chunk)}): {e} – kör om en och en")
+
+    results: List[List[Dict]] = []
+    for i, (hint, text) in enumerate(chunk):
+        if i in by_index:
+            llm_cache.store(_cache_key(text, hint), by_index[i])
+            results.append(by_index[i])
+        else:
+            results.append(extract_sms_prices_llm(email_text=text, provider_hint=hint))
+    return results
+
+
+# ---------------- Publika funktioner ----------------
 def extract_sms_prices_llm(email_text: str, provider_hint: Optional[str] = None) -> List[Dict]:
     """
     MOCK_LLM=true  -> använd snabb regelbaserad parser (ingen API-kostnad)
@@ -223,6 +447,12 @@ def extract_sms_prices_llm(email_text: str, provider_hint: Optional[str] = None)
     if _MOCK_LLM:
         return _rule_based_extract(email_text, provider_hint)
 
+    # samma text + hint + modell + prompt redan tolkad tidigare?
+    key = _cache_key(email_text, provider_hint)
+    cached = llm_cache.lookup(key)
+    if cached is not None:
+        return cached
+
     # produktionsläge: Gemini
     prompt = PRICE_EXTRACTION_PROMPT.format(
         email=email_text.strip(),
@@ -234,12 +464,162 @@ def extract_sms_prices_llm(email_text: str, provider_hint: Optional[str] = None)
         resp = model.generate_content(prompt)
         raw = (resp.text or "").strip()
         json_str = _first_json(raw) or raw
-        data = json.loads(json_str)
-        if isinstance(data, dict):
-            data = [data]
-        if not isinstance(data, list):
-            return []
-        return [_normalize_record(r) for r in data if isinstance(r, dict)]
+        rows = _rows_from_json(_json_loads(json_str))
+        llm_cache.store(key, rows)  # bara lyckade svar cachas
+        return rows
     except Exception as e:
         print(f"❌ LLM/parsningsfel: {e}")
         return []
+
+
+def extract_sms_prices_llm_batch(
+    items: List[Tuple[Optional[str], str]],
+    batch_size: int = 8,
+) -> List[List[Dict]]:
+    """
+    Som extract_sms_prices_llm, men för flera texter: items = [(provider_hint, text), ...].
+    Returnerar en lista med rader per post, i samma ordning som items.
+
+    MOCK_LLM=false -> texterna skickas i chunkar om batch_size per Gemini-anrop
+                      (BATCH_PRICE_EXTRACTION_PROMPT) i stället för ett anrop per text.
+    """
+    results: List[List[Dict]] = [[] for _ in items]
+
+    if _MOCK_LLM:
+        for i, (hint, text) in enumerate(items):
+            if text and text.strip():
+                results[i] = _rule_based_extract(text, hint)
+        return results
+
+    todo = _cached_or_todo(items, results)
+    if not todo:
+        return results
+
+    model = genai.GenerativeModel(_MODEL_NAME)
+    step = max(1, batch_size)
+    for start in range(0, len(todo), step):
+        idxs = todo[start:start + step]
+        chunk_rows = _extract_chunk_gemini(model, [items[i] for i in idxs])
+        for i, rows in zip(idxs, chunk_rows):
+            results[i] = rows
+    return results
+
+
+# ---------------- Asynkron Batch API ----------------
+def _batch_client():
+    if genai_batch is None:
+        raise RuntimeError("USE_BATCH_LLM kräver paketet google-genai (pip install google-genai)")
+    return genai_batch.Client(api_key=os.getenv("GOOGLE_API_KEY"))
+
+
+def submit_batch(prompts: List[str], custom_ids: Optional[List[str]] = None) -> str:
+    """
+    Skickar alla prompts som ETT asynkront batch-jobb (Gemini Batch API).
+    Varje rad i JSONL-filen: {"key": custom_id, "request": {"contents": [...]}}.
+    Returnerar jobbets namn (job_id) att skicka till poll_batch.
+    """
+    keys = custom_ids or [str(i) for i in range(len(prompts))]
+    if len(keys) != len(prompts):
+        raise ValueError("custom_ids måste ha samma längd som prompts")
+
+    client = _batch_client()
+    with tempfile.NamedTemporaryFile("w", suffix=".jsonl", encoding="utf-8", delete=False) as f:
+        for key, prompt in zip(keys, prompts):
+            req = {"contents": [{"role": "user", "parts": [{"text": prompt}]}]}
+            f.write(json.dumps({"key": key, "request": req}, ensure_ascii=False) + "\n")
+        jsonl_path = f.name
+    try:
+        uploaded = client.files.upload(
+            file=jsonl_path,
+            config={"display_name": os.path.basename(jsonl_path), "mime_type": "jsonl"},
+        )
+    finally:
+        os.remove(jsonl_path)
+
+    job = client.batches.create(
+        model=_MODEL_NAME,
+        src=uploaded.name,
+        config={"display_name": f"sms-prices-{time.strftime('%Y%m%d-%H%M%S')}"},
+    )
+    return job.name
+
+
+def poll_batch(
+    job_id: str,
+    poll_seconds: int = _BATCH_POLL_SECONDS,
+    timeout_seconds: int = _BATCH_TIMEOUT_SECONDS,
+) -> Dict[str, str]:
+    """
+    Väntar tills batch-jobbet är klart och laddar ner resultatet.
+    Returnerar {custom_id: råtext från modellen}. Poster med fel saknas i dict:en.
+    """
+    client = _batch_client()
+    deadline = time.monotonic() + timeout_seconds
+    while True:
+        job = client.batches.get(name=job_id)
+        state = job.state.name if job.state else ""
+        if state in _BATCH_DONE_STATES:
+            break
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"Batch-jobbet {job_id} blev inte klart inom {timeout_seconds}s (status {state})")
+        time.sleep(poll_seconds)
+
+    if state not in ("JOB_STATE_SUCCEEDED", "JOB_STATE_PARTIALLY_SUCCEEDED"):
+        raise RuntimeError(f"Batch-jobbet {job_id} avslutades med {state}: {job.error}")
+
+    raw = client.files.download(file=job.dest.file_name)
+    out: Dict[str, str] = {}
+    for line in raw.decode("utf-8").splitlines():
+        if not line.strip():
+            continue
+        rec = _json_loads(line)
+        candidates = (rec.get("response") or {}).get("candidates") or []
+        if rec.get("key") is None or not candidates:
+            continue
+        parts = (candidates[0].get("content") or {}).get("parts") or []
+        out[rec["key"]] = "".join(p.get("text", "") for p in parts)
+    return out
+
+
+def extract_sms_prices_llm_batch_job(
+    items: List[Tuple[Optional[str], str]],
+    custom_ids: Optional[List[str]] = None,
+) -> List[List[Dict]]:
+    """
+    Som extract_sms_prices_llm_batch, men via Gemini Batch API (submit_batch + poll_batch).
+    Passar daglig körning: hög latens är OK och batch-jobb debiteras lägre.
+    Faller tillbaka till synkrona anrop om jobbet misslyckas eller poster saknas.
+    """
+    if _MOCK_LLM:
+        return extract_sms_prices_llm_batch(items)
+
+    keys = custom_ids or [str(i) for i in range(len(items))]
+    results: List[List[Dict]] = [[] for _ in items]
+    todo = _cached_or_todo(items, results)
+    if not todo:
+        return results
+
+    prompts = [
+        PRICE_EXTRACTION_PROMPT.format(email=items[i][1].strip(), provider_hint=(items[i][0] or ""))
+        for i in todo
+    ]
+    try:
+        job_id = submit_batch(prompts, custom_ids=[keys[i] for i in todo])
+        print(f"⏳ Väntar på batch-jobb {job_id} ({len(prompts)} texter)...")
+        answers = poll_batch(job_id)
+    except Exception as e:
+        print(f"❌ Batch-jobb misslyckades: {e} – kör synkront")
+        return extract_sms_prices_llm_batch(items)
+
+    for i in todo:
+        hint, text = items[i]
+        raw = (answers.get(keys[i]) or "").strip()
+        try:
+            if not raw:
+                raise ValueError("svar saknas")
+            results[i] = _rows_from_json(_json_loads(_first_json(raw) or raw))
+            llm_cache.store(_cache_key(text, hint), results[i])
+        except Exception as e:
+            print(f"⚠️ Batch-svar för {keys[i]} kunde inte tolkas ({e}) – kör om synkront")
+            results[i] = extract_sms_prices_llm(email_text=text, provider_hint=hint)
+    return results
@@ -6,6 +6,9 @@ What’s here:
   ONLY JSON (no prose), as an array of rows. We encourage consistent keys like:
   country, operator/network, mcc, mnc, previous_rate/old_price, new_price/rate,
   currency, effective_from, variation.
+- BATCH_PRICE_EXTRACTION_PROMPT: Same schema/rules, but for several texts in one
+  call. Each text is wrapped with BATCH_ITEM_TEMPLATE ("--- ITEM [i] ... ---") and
+  the model returns [{"index": i, "rows": [...]}, ...].
 
 How to tweak:
 - If a supplier consistently includes extra fields (e.g., number_type, destination),
@@ -20,16 +23,7 @@ Safety:
 """
 
 
-PRICE_EXTRACTION_PROMPT = """
-Du är en assistent som analyserar prisuppdateringar från SMS-leverantörer
-och extraherar *strukturerad* data från e-post (tabeller eller löptext).
-
-VIKTIGT:
-- Returnera ENBART en giltig JSON-array (inga rubriker/kommentarer/kodblock).
-- En rad i tabellen/löptexten = ett objekt i arrayen.
-- Om ingen prisinformation hittas, returnera [].
-
-SCHEMA (alla fält är valfria; saknas värde -> null):
+_SCHEMA_AND_RULES = """SCHEMA (alla fält är valfria; saknas värde -> null):
 {{
   "provider": string|null,
   "country": string|null,
@@ -65,7 +59,19 @@ REGLER:
 - Kolumner som "MCC/MNC/IMSI/NNC/Number Type/Count/Cost(EUR)/Product category" stöds.
 - Om bara en kolumn "Rate" finns: sätt price, och försök härleda currency från rubriken eller radens text.
 
-HINT OM LEVERANTÖR (kan hjälpa dig att sätta 'provider'):
+"""
+
+
+PRICE_EXTRACTION_PROMPT = """
+Du är en assistent som analyserar prisuppdateringar från SMS-leverantörer
+och extraherar *strukturerad* data från e-post (tabeller eller löptext).
+
+VIKTIGT:
+- Returnera ENBART en giltig JSON-array (inga rubriker/kommentarer/kodblock).
+- En rad i tabellen/löptexten = ett objekt i arrayen.
+- Om ingen prisinformation hittas, returnera [].
+
+""" + _SCHEMA_AND_RULES + """HINT OM LEVERANTÖR (kan hjälpa dig att sätta 'provider'):
 {provider_hint}
 
 E-POSTINNEHÅLL:
@@ -75,3 +81,27 @@ E-POSTINNEHÅLL:
 
 RETURNERA ENBART EN JSON-ARRAY ENLIGT SCHEMAT.
 """
+
+
+BATCH_PRICE_EXTRACTION_PROMPT = """
+Du är en assistent som analyserar prisuppdateringar från SMS-leverantörer
+och extraherar *strukturerad* data från flera texter (e-post eller bilagor) åt gången.
+
+VIKTIGT:
+- Varje text inleds med en rad "--- ITEM [i] provider_hint=... ---" där i är textens index.
+- Behandla varje ITEM för sig; blanda aldrig rader mellan olika ITEMs.
+- Returnera ENBART en giltig JSON-array (inga rubriker/kommentarer/kodblock) med
+  exakt ett objekt per ITEM: {{"index": i, "rows": [ ... ]}}.
+- En rad i tabellen/löptexten = ett objekt i "rows".
+- Om ingen prisinformation hittas i en ITEM, returnera "rows": [].
+
+""" + _SCHEMA_AND_RULES + """
+TEXTER:
+{items}
+
+RETURNERA ENBART EN JSON-ARRAY: [{{"index": 0, "rows": [...]}}, {{"index": 1, "rows": [...]}}, ...]
+"""
+
+BATCH_ITEM_TEMPLATE = """--- ITEM [{index}] provider_hint={provider_hint} ---
+{text}
+"""
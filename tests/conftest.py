@@ -0,0 +1,14 @@
+import pytest
+
+from llm import _cache as llm_cache
+from utils import attachment_parser
+
+
+@pytest.fixture(autouse=True)
+def _runtime_dirs_in_tmp(tmp_path, monkeypatch):
+    """Cacher och DRY_RUN-utkorgen (logs/…) skrivs under tmp_path, inte i arbetskatalogen."""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(llm_cache, "CACHE_DIR", str(tmp_path / "logs" / "llm_cache"))
+    monkeypatch.setattr(llm_cache, "_cache", None)
+    monkeypatch.setattr(attachment_parser, "_TEXT_CACHE_DIR", str(tmp_path / "logs" / "att_cache"))
+    monkeypatch.setattr(attachment_parser, "_text_cache", None)
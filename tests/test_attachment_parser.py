@@ -30,3 +30,36 @@ def test_parse_excel_basic():
     assert r["mnc"] == "02"
     assert r["price"] == 0.0305
     assert r["currency"] == "EUR"
+
+def test_parse_csv_cleans_numbers_and_blank_cells():
+    csv = "Country,MCC,Previous Rate,Old Rate,New Price,Change\n" \
+          "Kuwait,419,,0.02,\"0,0305 €\",Increase \n" \
+          "Sweden,240,0.05,0.04,n/a,\n"
+    out = parse_attachments([{"filename": "p.csv", "content_type": "", "data": csv.encode()}],
+                            provider_hint="P")
+    a, b = out["rows"]
+    assert a["mcc"] == "419" and a["new_price"] == 0.0305 and a["variation"] == "increase"
+    assert a["previous_rate"] is None and a["old_price"] == 0.02  # tom cell (CSV) -> None
+    assert b["previous_rate"] == 0.05 and b["new_price"] is None and b["variation"] is None
+    assert a["provider"] == "P" and a["currency"] is None
+
+def test_excel_chunks_do_not_change_row_values():
+    from utils.attachment_parser import _df_to_rows, _iter_excel_frames
+    df = pd.DataFrame({
+        "Country": ["Kuwait", "Kuwait", "Sweden", "Norway"],
+        "MCC": [419, None, 420, 242],
+        "Rate": [0.03, 0.04, 0.05, 0.06],
+    })
+    content = _excel_bytes(df)
+    chunked = [r for f in _iter_excel_frames(content, chunk_rows=2) for r in _df_to_rows(f)]
+    whole = [r for f in _iter_excel_frames(content, chunk_rows=10) for r in _df_to_rows(f)]
+    assert [r["mcc"] for r in chunked] == ["419", None, "420", "242"]
+    assert chunked == whole
+
+def test_effective_date_keeps_time_for_midnight_column():
+    from utils.attachment_parser import _df_to_rows
+    df = pd.DataFrame({"Country": ["Kuwait", "Sweden"],
+                       "Effective Date": pd.to_datetime(["2025-09-08", None])})
+    a, b = _df_to_rows(df)
+    assert a["effective_from"] == "2025-09-08 00:00:00"  # som str(Timestamp)
+    assert b["effective_from"] is None
@@ -0,0 +1,84 @@
+import os
+from email.message import EmailMessage
+from utils import email_reader
+from utils.email_reader import iter_eml_messages
+
+
+def _write_eml(path):
+    msg = EmailMessage()
+    msg["From"] = "a@x.se"; msg["To"] = "b@x.se"; msg["Subject"] = "Price"
+    msg.set_content("Country: Testland\nRate 0.12 EUR\n")
+    msg.add_attachment(b"Country,Rate\nTestland,0.12\n", maintype="text", subtype="csv", filename="prices.csv")
+    with open(path, "wb") as f:
+        f.write(bytes(msg))
+
+
+def test_fast_and_stdlib_paths_agree(tmp_path, monkeypatch):
+    _write_eml(tmp_path / "mail.eml")
+    fast = list(iter_eml_messages(str(tmp_path)))
+    monkeypatch.setattr(email_reader, "parse_email", None)
+    email_reader._eml_cache_clear()
+    slow = list(iter_eml_messages(str(tmp_path)))
+
+    assert len(fast) == len(slow) == 1
+    assert fast[0]["body"].strip() == slow[0]["body"].strip() == "Country: Testland\nRate 0.12 EUR"
+    assert fast[0]["attachments"] == slow[0]["attachments"]
+    assert fast[0]["attachments"][0]["filename"] == "prices.csv"
+
+
+def test_unchanged_file_served_from_cache(tmp_path, monkeypatch):
+    path = tmp_path / "mail.eml"
+    _write_eml(path)
+    email_reader._eml_cache_clear()
+    monkeypatch.setattr(email_reader, "_EML_CACHE_MAX_BYTES", 1024 * 1024)  # av som standard
+    first = list(iter_eml_messages(str(tmp_path)))
+
+    def _boom(payload):
+        raise AssertionError("parsed again")
+
+    monkeypatch.setattr(email_reader, "_parse_fast", _boom)
+    monkeypatch.setattr(email_reader, "_parse_stdlib", _boom)
+    assert list(iter_eml_messages(str(tmp_path))) == first
+
+
+def test_html_only_body_becomes_text(tmp_path, monkeypatch):
+    msg = EmailMessage()
+    msg["From"] = "a@x.se"; msg["To"] = "b@x.se"; msg["Subject"] = "Price"
+    msg.set_content("<html><body><p>Country: <b>Kuwait</b></p><p>New Price 0.0305 EUR</p>"
+                    "<style>p {color: red}</style></body></html>", subtype="html")
+    with open(tmp_path / "mail.eml", "wb") as f:
+        f.write(bytes(msg))
+
+    fast = list(iter_eml_messages(str(tmp_path)))
+    monkeypatch.setattr(email_reader, "parse_email", None)
+    email_reader._eml_cache_clear()
+    slow = list(iter_eml_messages(str(tmp_path)))
+
+    assert fast[0]["body"] == slow[0]["body"] == "Country: Kuwait\nNew Price 0.0305 EUR"
+
+
+def test_cache_is_bounded_in_bytes(tmp_path, monkeypatch):
+    for i in range(3):
+        _write_eml(tmp_path / f"mail{i}.eml")
+    size = (tmp_path / "mail0.eml").stat().st_size
+    email_reader._eml_cache_clear()
+    monkeypatch.setattr(email_reader, "_EML_CACHE_MAX_BYTES", 2 * size)
+    assert len(list(iter_eml_messages(str(tmp_path)))) == 3
+    assert list(email_reader._EML_CACHE) == [str(tmp_path / "mail1.eml"), str(tmp_path / "mail2.eml")]
+    assert email_reader._eml_cache_bytes == 2 * size
+
+
+def test_cache_is_off_by_default_and_replaces_stale_entries(tmp_path, monkeypatch):
+    path = tmp_path / "mail.eml"
+    _write_eml(path)
+    email_reader._eml_cache_clear()
+    list(iter_eml_messages(str(tmp_path)))
+    assert not email_reader._EML_CACHE
+
+    monkeypatch.setattr(email_reader, "_EML_CACHE_MAX_BYTES", 1024 * 1024)
+    list(iter_eml_messages(str(tmp_path)))
+    st = path.stat()
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))  # ny mtime: samma sökväg, ny post
+    list(iter_eml_messages(str(tmp_path)))
+    assert len(email_reader._EML_CACHE) == 1
+    assert email_reader._eml_cache_bytes == st.st_size
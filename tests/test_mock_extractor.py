@@ -19,3 +19,14 @@ def test_mock_llm_extract(monkeypatch):
     assert rows[0]["old_price"] == 0.03
     assert rows[0]["new_price"] == 0.0305
     assert rows[0]["currency"] == "EUR"
+
+
+def test_prefilter_keeps_non_ascii_blocks(monkeypatch):
+    from llm import extractor
+    block = "Country: Turkey\nPrıce 0.05 EUR"  # 'ı' matchar 'i' med re.I, inte i Hyperscan
+    monkeypatch.setattr(extractor, "HAS_HYPERSCAN", False)
+    plain = extractor._rule_based_extract(block, "P")
+    monkeypatch.setattr(extractor, "HAS_HYPERSCAN", True)
+    if extractor._HS_PRICE_DB is None:
+        monkeypatch.setattr(extractor, "_hs_has_price", lambda b: False)  # förfilter som sållar allt
+    assert plain and extractor._rule_based_extract(block, "P") == plain
@@ -0,0 +1,57 @@
+import io
+from utils.pipeline import diff_with_analyzer, render_diff_html
+from utils.price_analyzer import index_prices
+
+
+def test_diff_with_analyzer_and_render():
+    prev = [{"country": "Kuwait", "mcc": "419", "mnc": "02", "new_price": 0.03},
+            {"country": "Sweden", "mcc": "240", "mnc": "01", "new_price": 0.05}]
+    today = [{"country": "Kuwait", "mcc": "419", "mnc": "02", "new_price": 0.04},
+             {"country": "Norway", "mcc": "242", "mnc": "01", "price": 0.06}]
+    _, today_map = index_prices(today)
+    _, prev_map = index_prices(prev)
+
+    diff = diff_with_analyzer(today_map, prev_map)
+    assert [c["direction"] for c in diff["changed"]] == ["increase"]
+    assert diff["new"][0]["new"] == 0.06
+    assert diff["removed"][0]["old"] == 0.05
+
+    buf = io.BytesIO()
+    render_diff_html(diff, buf, "2024-01-01")
+    html = buf.getvalue().decode("utf-8")
+    assert "Summary – 2024-01-01" in html and "Changed: 1 · New: 1 · Removed: 1" in html
+    assert "0.040000" in html and "<td>Norway</td>" in html
+
+
+def _write_eml(path, body, attachment=None):
+    from email.message import EmailMessage
+    msg = EmailMessage()
+    msg["From"] = "a@x.se"; msg["To"] = "b@x.se"; msg["Subject"] = "Price"
+    msg.set_content(body)
+    if attachment is not None:
+        msg.add_attachment(attachment, maintype="text", subtype="csv", filename="prices.csv")
+    path.write_bytes(bytes(msg))
+
+
+def test_process_all_parses_paths_in_workers(tmp_path, monkeypatch):
+    from utils.pipeline import _process_all
+    _write_eml(tmp_path / "a.eml", "Hej", b"Country,MCC,Rate\nKuwait,419,0.03\n")
+    _write_eml(tmp_path / "b.eml", "Hej", b"Country,MCC,Rate\nSweden,240,0.05\n")
+    monkeypatch.setenv("PIPELINE_WORKERS", "2")
+    paths = [str(tmp_path / "a.eml"), str(tmp_path / "missing.eml"), str(tmp_path / "b.eml")]
+
+    res = _process_all(paths)
+    assert [r["filename"] for r in res] == ["a.eml", "b.eml"]  # saknad fil hoppas över
+    assert [r["rows"][0]["country"] for r in res] == ["Kuwait", "Sweden"]
+
+
+def test_body_skipped_only_when_whole_words_in_attachment(tmp_path, monkeypatch):
+    from utils import pipeline
+    text = "Country: Kuwait\nOperator: zain\nNew Price 0.055 EUR\n"
+    monkeypatch.setattr(pipeline, "parse_attachments",
+                        lambda atts, provider_hint=None: {"rows": [], "texts": [text]})
+    _write_eml(tmp_path / "same.eml", "Operator:  zain\nNew price 0.055", b"x")
+    _write_eml(tmp_path / "other.eml", "zain New Price 0.05", b"x")
+
+    assert pipeline._process_one(str(tmp_path / "same.eml"))["body"] is None
+    assert pipeline._process_one(str(tmp_path / "other.eml"))["body"].strip() == "zain New Price 0.05"
@@ -0,0 +1,75 @@
+from utils.price_analyzer import compare_prices, load_previous_prices, save_current_prices
+
+
+def _row(country, network, price, mcc="1", mnc="1"):
+    return {"country": country, "network": network, "mcc": mcc, "mnc": mnc,
+            "currency": "EUR", "price": price}
+
+
+def test_compare_prices_changed_new_removed():
+    prev = [_row("Sweden", "Telia", 0.05), _row("Norway", "Telenor", 0.04), _row("Kuwait", "Zain", 0.03)]
+    cur = [_row("Sweden", "Telia", 0.06), _row("Kuwait", "Zain", 0.03), _row("Finland", "Elisa", 0.02)]
+
+    diff = compare_prices(cur, prev)
+
+    assert [c["after"]["country"] for c in diff["changed"]] == ["Sweden"]
+    assert abs(diff["changed"][0]["delta"] - 0.01) < 1e-9
+    assert [n["country"] for n in diff["new"]] == ["Finland"]
+    assert [r["country"] for r in diff["removed"]] == ["Norway"]
+    assert diff["summary"] == {"changed": 1, "new": 1, "removed": 1}
+
+
+def test_jsonl_snapshot_roundtrip(tmp_path):
+    rows = [_row("Sverige", "Telia", 0.05), _row("Kuwait", "Zain", None)]
+    save_current_prices(rows, tmp_path / "parsed_2025-01-01.jsonl")
+
+    lines = (tmp_path / "latest.jsonl").read_bytes().splitlines()
+    assert len(lines) == 2
+    assert load_previous_prices(tmp_path / "latest.jsonl") == rows
+    assert load_previous_prices(tmp_path / "parsed_2025-01-01.jsonl") == rows
+
+
+def test_compare_same_snapshot_is_empty():
+    rows = [_row("Sweden", "Telia", 0.05), _row("Kuwait", "Zain", None)]
+    assert compare_prices(rows, rows)["summary"] == {"changed": 0, "new": 0, "removed": 0}
+
+
+def test_latest_is_hard_link_to_snapshot(tmp_path):
+    import os
+    save_current_prices([_row("Sweden", "Telia", 0.05)], tmp_path / "parsed_2025-01-01.jsonl")
+    save_current_prices([_row("Sweden", "Telia", 0.06)], tmp_path / "parsed_2025-01-02.jsonl")
+
+    snap = tmp_path / "parsed_2025-01-02.jsonl"
+    latest = tmp_path / "latest.jsonl"
+    assert os.path.samefile(snap, latest)  # samma inod – skrivs inte två gånger
+    assert load_previous_prices(latest)[0]["price"] == 0.06
+    assert load_previous_prices(tmp_path / "parsed_2025-01-01.jsonl")[0]["price"] == 0.05
+    assert not list(tmp_path.glob("*.tmp"))
+
+
+def test_load_legacy_json_with_nan(tmp_path):
+    # Äldre snapshots skrevs med stdlib json.dump, som skriver tomma celler som NaN
+    p = tmp_path / "latest.json"
+    p.write_text('{"date": "2025-01-01", "rows": [{"country": "Sweden", "network": "Telia", '
+                 '"mcc": "240", "mnc": "1", "currency": NaN, "price": 0.05}]}', encoding="utf-8")
+    rows = load_previous_prices(p)
+    assert len(rows) == 1
+    assert rows[0]["price"] == 0.05
+    assert rows[0]["currency"] != rows[0]["currency"]  # NaN
+
+
+def test_load_previous_index_matches_rows(tmp_path):
+    from utils.price_analyzer import index_prices, load_previous_index
+    rows = [_row("Sweden", "Telia", 0.05), _row("Kuwait", "Zain", None)]
+    save_current_prices(rows, tmp_path / "parsed_2025-01-01.jsonl")
+    assert load_previous_index(tmp_path / "latest.jsonl") == index_prices(rows)[1]
+    assert load_previous_index(tmp_path / "missing.jsonl") == {}
+
+
+def test_publish_twice_leaves_no_tmp(tmp_path):
+    rows = [_row("Sweden", "Telia", 0.05)]
+    save_current_prices(rows, tmp_path / "parsed_2025-01-01.jsonl")
+    save_current_prices(rows, tmp_path / "parsed_2025-01-01.jsonl")  # omkörning samma dag
+    save_current_prices(rows, tmp_path / "latest.jsonl")  # snapshot = latest själv
+    assert not list(tmp_path.glob("*.tmp"))
+    assert load_previous_prices(tmp_path / "latest.jsonl") == rows
@@ -2,8 +2,9 @@
 Parse attachments and normalize them into pricing rows (or text blocks for the LLM).
 
 Supports:
-- Excel/CSV → read with pandas/openpyxl and map common columns to a standard schema
+- Excel/CSV → read with python-calamine (or openpyxl read-only, values only) / pandas and map common columns to a standard schema
 - PDF/DOCX → extract text; return as "texts" for the LLM to interpret
+  (cached on disk per attachment content in logs/att_cache when diskcache is installed)
 
 Output contract:
 - For spreadsheet-like inputs: normalized rows (dicts) ready for diff/snapshot.
@@ -11,45 +12,64 @@ Output contract:
 """
 
 
+import os
 import re
+import hashlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime
+from functools import lru_cache
 from io import BytesIO
-from typing import List, Dict, Any
+from typing import Callable, Iterator, List, Dict, Any, Optional, Tuple
 
 import pandas as pd
+from openpyxl import load_workbook
+
+# python-calamine (Rust) läser xlsx/xls betydligt snabbare än openpyxl; openpyxl är fallback
+try:
+    from python_calamine import CalamineWorkbook
+except ImportError:
+    CalamineWorkbook = None
 
 try:
     import docx  # python-docx
 except ImportError:
     docx = None
 
+try:
+    import pypdfium2 as pdfium  # PDFium (C++): snabb textextraktion, pdfplumber är fallback
+except ImportError:
+    pdfium = None
+
 try:
     import pdfplumber
 except ImportError:
     pdfplumber = None
 
+# diskcache: extraherad PDF/DOCX-text cachas per bilaga (sha256 av innehållet)
+try:
+    import diskcache
+except ImportError:
+    diskcache = None
+
+_TEXT_CACHE_DIR = os.getenv("ATT_CACHE_DIR", "logs/att_cache")
+_TEXT_CACHE_SIZE = int(os.getenv("ATT_CACHE_SIZE_MB", "256")) * 1024 * 1024
+_text_cache = None
+
+# max antal processer för bilagor i samma mail
+_ATT_WORKERS = 4
+
+# Excel läses i bitar om så här många rader (en DataFrame per bit)
+_EXCEL_CHUNK_ROWS = 50_000
+
 
 # --------- Hjälpfunktioner ---------
-def _norm_col(s: str) -> str:
-    return re.sub(r"[^a-z0-9]", "", s.strip().lower())
+_RE_NONALNUM = re.compile(r"[^a-z0-9]")
+_RE_NONNUM = re.compile(r"[^0-9.\-]")
 
 
-def _to_float(val):
-    if val is None:
-        return None
-    if isinstance(val, (int, float)):
-        return float(val)
-    s = str(val)
-    s = s.replace("€", "").replace("$", "").replace("£", "")
-    s = s.replace("\u00a0", " ").strip()
-    s = s.replace(",", ".")
-    s = re.sub(r"[A-Za-z]", "", s)
-    s = re.sub(r"[^0-9.\-]", "", s)
-    if s in ("", ".", "-"):
-        return None
-    try:
-        return float(s)
-    except Exception:
-        return None
+def _norm_col(s: str) -> str:
+    return _RE_NONALNUM.sub("", s.strip().lower())
 
 
 # synonymer -> fältnamn i vårt schema
@@ -87,11 +107,20 @@ _COL_MAP = {
 }
 
 
+# samma tabell med nycklarna garanterat normaliserade (som _norm_col ger dem)
+_COL_MAP_NORMALIZED = {_norm_col(k): v for k, v in _COL_MAP.items()}
+
+
+@lru_cache(maxsize=1024)
+def _resolve_col(raw: str) -> Optional[str]:
+    """Kolumnrubrik -> schemafält (eller None). Rubriker återkommer mellan blad/filer, så svaret cachas."""
+    return _COL_MAP_NORMALIZED.get(_norm_col(raw))
+
+
 def _map_columns(df: pd.DataFrame) -> pd.DataFrame:
     rename = {}
     for c in df.columns:
-        key = _norm_col(str(c))
-        tgt = _COL_MAP.get(key)
+        tgt = _resolve_col(str(c))
         if tgt:
             rename[c] = tgt
     if rename:
@@ -99,51 +128,202 @@ def _map_columns(df: pd.DataFrame) -> pd.DataFrame:
     return df
 
 
-def _row_to_schema(row: dict, default_currency=None) -> dict:
-    out = {
-        "provider": None,
-        "country": row.get("country"),
-        "country_iso": row.get("country_iso"),
-        "country_code": row.get("country_code"),
-        "operator": row.get("operator"),
-        "network": row.get("network"),
-        "mcc": (str(row.get("mcc")) if row.get("mcc") is not None else None),
-        "mnc": (str(row.get("mnc")) if row.get("mnc") is not None else None),
-        "imsi": (str(row.get("imsi")) if row.get("imsi") is not None else None),
-        "nnc": (str(row.get("nnc")) if row.get("nnc") is not None else None),
-        "number_type": row.get("number_type"),
-        "destination": (str(row.get("destination")) if row.get("destination") is not None else None),
-        "previous_rate": _to_float(row.get("previous_rate")) if row.get("previous_rate") is not None else _to_float(row.get("old_price")),
-        "old_price": _to_float(row.get("old_price")),
-        "current_rate": _to_float(row.get("current_rate")),
-        "new_price": _to_float(row.get("new_price")),
-        "price": _to_float(row.get("price")),
-        "currency": row.get("currency") or default_currency,
-        "variation": (str(row.get("variation")).strip().lower() if row.get("variation") else None),
-        "effective_from": (str(row.get("effective_from")) if row.get("effective_from") is not None else None),
-        "count": _to_float(row.get("count")),
-        "cost": _to_float(row.get("cost")),
-        "product_category": row.get("product_category"),
-        "notes": None,
-    }
-    return out
+# kolumner i utdata (samma ordning som LLM-schemat)
+_SCHEMA_FIELDS = (
+    "provider", "country", "country_iso", "country_code", "operator", "network",
+    "mcc", "mnc", "imsi", "nnc", "number_type", "destination",
+    "previous_rate", "old_price", "current_rate", "new_price", "price",
+    "currency", "variation", "effective_from", "count", "cost",
+    "product_category", "notes",
+)
+_NUM_FIELDS = ("old_price", "current_rate", "new_price", "price", "count", "cost")
+_STR_FIELDS = ("mcc", "mnc", "imsi", "nnc", "destination", "effective_from")
+
+
+def _nullify(s: pd.Series) -> pd.Series:
+    """object-kolumn där NaN/NaT/None blir None."""
+    return s.astype(object).where(s.notna(), None)
+
+
+def _num_col(s: pd.Series) -> pd.Series:
+    """
+    Kolumnvis motsvarighet till gamla _to_float: tal -> float; strängar rensas
+    (',' -> '.', allt utom siffror/'.'/'-' bort) och tolkas; resten -> None.
+    """
+    if pd.api.types.is_bool_dtype(s) or pd.api.types.is_numeric_dtype(s):
+        return _nullify(s.astype(float))
+    if not (pd.api.types.is_object_dtype(s) or pd.api.types.is_string_dtype(s)):
+        return pd.Series([None] * len(s), index=s.index, dtype=object)  # t.ex. datum i en priskolumn
+    # .str ger NaN för element som inte är strängar – de tas från to_numeric nedan
+    try:
+        cleaned = s.str.replace(",", ".", regex=False).str.replace(_RE_NONNUM, "", regex=True)
+    except AttributeError:
+        # object-kolumn helt utan strängar (t.ex. None + tal)
+        return _nullify(pd.to_numeric(s, errors="coerce").astype(float))
+    is_str = cleaned.notna()
+    from_str = pd.to_numeric(cleaned.where(is_str), errors="coerce")
+    from_num = pd.to_numeric(s.where(~is_str), errors="coerce")
+    return _nullify(from_str.where(is_str, from_num).astype(float))
+
+
+def _str_col(s: pd.Series) -> pd.Series:
+    # str() per värde som gamla str(v): astype(str) på en datetime64-kolumn tappar
+    # klockslaget när alla värden är midnatt
+    return pd.Series([None if pd.isna(v) else str(v) for v in s], index=s.index, dtype=object)
+
+
+def _truthy(s: pd.Series) -> pd.Series:
+    return s.notna() & s.astype(object).fillna(False).astype(bool)
 
 
 def _df_to_rows(df: pd.DataFrame, default_currency=None) -> List[dict]:
+    """
+    DataFrame -> normaliserade rader. Kolumnvis (ingen iterrows): varje fält
+    räknas fram över hela kolumnen och raderna byggs i ett svep på slutet.
+    Tomma celler (NaN) blir None.
+    """
     df = _map_columns(df)
-    rows = []
-    for _, r in df.iterrows():
-        rows.append(_row_to_schema(r.to_dict(), default_currency=default_currency))
-    return rows
+    # dubbla kolumner efter mappning (t.ex. "Rate" + "Price"): sista vinner, som förut
+    df = df.loc[:, ~df.columns.duplicated(keep="last")].reset_index(drop=True)
+    n = len(df)
+    if n == 0:
+        return []
+
+    cols = set(df.columns)
+    nones = [None] * n
+    out: Dict[str, list] = {}
+    for f in _SCHEMA_FIELDS:
+        if f not in cols:
+            out[f] = nones  # saknad kolumn: inget att räkna
+        elif f in _NUM_FIELDS:
+            out[f] = _num_col(df[f]).tolist()
+        elif f in _STR_FIELDS:
+            out[f] = _str_col(df[f]).tolist()
+        else:
+            out[f] = _nullify(df[f]).tolist()
+
+    # previous_rate faller tillbaka på old_price när cellen saknas
+    if "previous_rate" in cols:
+        raw = df["previous_rate"]
+        old = pd.Series(out["old_price"], dtype=object)
+        out["previous_rate"] = _num_col(raw).where(raw.notna(), old).tolist()
+    else:
+        out["previous_rate"] = out["old_price"]
+
+    if "currency" in cols:
+        cur = df["currency"]
+        out["currency"] = cur.astype(object).where(_truthy(cur), default_currency).tolist()
+    else:
+        out["currency"] = [default_currency] * n
+
+    if "variation" in cols:
+        var = df["variation"]
+        out["variation"] = (var.astype(str).str.strip().str.lower().astype(object)
+                            .where(_truthy(var), None).tolist())
+
+    out["provider"] = out["notes"] = nones
+    # raderna byggs med zip över kolumnlistor (DataFrame.to_dict boxar varje cell för sig)
+    fields = _SCHEMA_FIELDS
+    return [dict(zip(fields, vals)) for vals in zip(*(out[f] for f in fields))]
 
 
 # --------- Parsers per filtyp ---------
+def _header_names(header: tuple, width: int) -> List[str]:
+    """Rubrikrad -> kolumnnamn som pandas: tomma blir 'Unnamed: i', dubbletter får .1, .2 …"""
+    names = []
+    seen: Dict[Any, int] = {}
+    for i in range(width):
+        name = header[i] if i < len(header) else None
+        if name is None or name == "":
+            name = f"Unnamed: {i}"
+        n = seen.get(name, 0)
+        seen[name] = n + 1
+        names.append(f"{name}.{n}" if n else name)
+    return names
+
+
+def _cell(v):
+    # som pandas: heltalsvärda floats från Excel blir int (419.0 -> 419)
+    if type(v) is float and v.is_integer():
+        return int(v)
+    return v
+
+
+def _calamine_row(row) -> tuple:
+    # calamine: tom cell = "", datum utan tid = date – samma form som openpyxl (None, datetime)
+    return tuple(
+        None if v == "" else datetime(v.year, v.month, v.day) if type(v) is date else v
+        for v in row
+    )
+
+
+def _sheets_calamine(wb) -> Iterator[Iterator[tuple]]:
+    for name in wb.sheet_names:
+        yield map(_calamine_row, wb.get_sheet_by_name(name).iter_rows())
+
+
+def _sheets_openpyxl(content: bytes) -> Iterator[Iterator[tuple]]:
+    wb = load_workbook(BytesIO(content), read_only=True, data_only=True)
+    try:
+        for ws in wb.worksheets:
+            yield ws.iter_rows(values_only=True)
+    finally:
+        wb.close()
+
+
+def _excel_sheets(content: bytes) -> Iterator[Iterator[tuple]]:
+    """
+    Radvärden per blad: python-calamine (Rust) om det finns och kan öppna filen,
+    annars openpyxl i read_only-läge (endast värden – inga stilar/formler i minnet).
+    """
+    if CalamineWorkbook is not None:
+        try:
+            wb = CalamineWorkbook.from_filelike(BytesIO(content))
+        except Exception:
+            wb = None  # t.ex. filtyp calamine inte klarar – prova openpyxl
+        if wb is not None:
+            return _sheets_calamine(wb)
+    return _sheets_openpyxl(content)
+
+
+def _iter_excel_frames(content: bytes, chunk_rows: int = _EXCEL_CHUNK_ROWS) -> Iterator[pd.DataFrame]:
+    """
+    DataFrames om högst chunk_rows rader per blad (se _excel_sheets). Första raden är
+    rubrik; helt tomma rader hoppas över. Celler utanför rubrikens bredd ignoreras
+    (de mappas aldrig). dtype=object: cellvärdena behålls som de är, så en rads
+    resultat beror inte på vilka andra rader som hamnar i samma chunk.
+    """
+    for it in _excel_sheets(content):
+        header = next(it, None)
+        if header is None:
+            continue
+        width = len(header)
+        names = _header_names(header, width)
+        lists: List[list] = [[] for _ in names]
+        count = 0
+        for row in it:
+            if all(v is None for v in row):
+                continue
+            n = len(row)
+            for i, col in enumerate(lists):
+                col.append(_cell(row[i]) if i < n else None)
+            count += 1
+            if count >= chunk_rows:
+                yield pd.DataFrame(dict(zip(names, lists)), columns=names, dtype=object)
+                lists = [[] for _ in names]
+                count = 0
+        if count:
+            yield pd.DataFrame(dict(zip(names, lists)), columns=names, dtype=object)
+
+
+def _iter_excel_rows(content: bytes) -> Iterator[dict]:
+    """Normaliserade rader från alla blad, en chunk i taget (se _iter_excel_frames)."""
+    for df in _iter_excel_frames(content):
+        yield from _df_to_rows(df)
+
+
 def _parse_excel(content: bytes) -> List[dict]:
-    dfs = pd.read_excel(BytesIO(content), sheet_name=None, engine="openpyxl")
-    rows = []
-    for _, df in dfs.items():
-        rows.extend(_df_to_rows(df))
-    return rows
+    return list(_iter_excel_rows(content))
 
 
 def _parse_csv(content: bytes) -> List[dict]:
@@ -171,7 +351,30 @@ def _parse_docx_to_texts(content: bytes) -> List[str]:
     return blobs
 
 
+def _pdf_text_pdfium(content: bytes) -> str:
+    pdf = pdfium.PdfDocument(content)
+    try:
+        pages_text = []
+        for page in pdf:
+            textpage = page.get_textpage()
+            pages_text.append(textpage.get_text_range())
+            textpage.close()
+            page.close()
+    finally:
+        pdf.close()
+    return "\n".join(pages_text).replace("\r\n", "\n").strip()
+
+
 def _parse_pdf_to_texts(content: bytes) -> List[str]:
+    # PDFium läser bara textlagret (ingen layoutmodell) – mycket snabbare än pdfplumber.
+    # Saknas text (eller går filen inte att öppna) försöker vi med pdfplumber.
+    if pdfium is not None:
+        try:
+            text = _pdf_text_pdfium(content)
+        except Exception:
+            text = ""
+        if text:
+            return [text]
     if pdfplumber is None:
         return []
     blobs = []
@@ -185,6 +388,83 @@ def _parse_pdf_to_texts(content: bytes) -> List[str]:
     return blobs
 
 
+def _get_text_cache():
+    global _text_cache
+    if diskcache is None or os.getenv("ATT_CACHE", "true").lower() not in ("1", "true", "yes"):
+        return None
+    if _text_cache is None:
+        _text_cache = diskcache.Cache(_TEXT_CACHE_DIR, size_limit=_TEXT_CACHE_SIZE,
+                                      eviction_policy="least-recently-used")
+    return _text_cache
+
+
+def _cached_texts(kind: str, data: bytes, parse: Callable[[bytes], List[str]]) -> List[str]:
+    """
+    Kör parse(data) en gång per unikt bilageinnehåll: samma PDF/DOCX som skickas
+    igen (t.ex. dagen efter) hämtas ur cachen i stället för att tolkas om.
+    """
+    cache = _get_text_cache()
+    if cache is None:
+        return parse(data)
+    key = f"{kind}:{hashlib.sha256(data).hexdigest()}"
+    try:
+        texts = cache.get(key)
+    except Exception:
+        texts = None
+    if texts is None:
+        texts = parse(data)
+        try:
+            cache.set(key, texts)
+        except Exception:
+            pass  # cachen är bara en optimering
+    return texts
+
+
+def _classify(name: str, ctype: str) -> Optional[str]:
+    if name.endswith((".xlsx", ".xlsm", ".xls")) or "excel" in ctype:
+        return "excel"
+    if name.endswith(".csv") or "csv" in ctype:
+        return "csv"
+    if name.endswith(".docx") or "word" in ctype:
+        return "docx"
+    if name.endswith(".pdf") or "pdf" in ctype:
+        return "pdf"
+    return None  # okänd typ – gör inget (eller lägg logik för .zip osv.)
+
+
+def _dispatch(task: Tuple[str, str, bytes]) -> Tuple[List[dict], List[str]]:
+    """Tolkar en bilaga -> (rows, texts). Modulnivå så att den kan köras i en worker-process."""
+    kind, filename, data = task
+    try:
+        if kind == "excel":
+            return _parse_excel(data), []
+        if kind == "csv":
+            return _parse_csv(data), []
+        if kind == "docx":
+            return [], _cached_texts("docx", data, _parse_docx_to_texts)
+        # nyckeln följer motorn, så text från den andra motorn inte återanvänds
+        return [], _cached_texts("pdf" if pdfium is None else "pdf-pdfium", data, _parse_pdf_to_texts)
+    except Exception as e:
+        print(f"⚠️ Kunde inte tolka bilagan {filename}: {e}")
+        return [], []
+
+
+def _dispatch_all(tasks: List[Tuple[str, str, bytes]]) -> List[Tuple[List[dict], List[str]]]:
+    """
+    Kör _dispatch över bilagorna, parallellt i processer när det lönar sig.
+    Seriellt om det bara finns en bilaga, eller om vi redan kör i en worker-process
+    (app.py parsar mail parallellt – inga nästlade pooler).
+    """
+    workers = min(_ATT_WORKERS, len(tasks))
+    if workers > 1 and multiprocessing.parent_process() is None:
+        try:
+            with ProcessPoolExecutor(max_workers=workers) as ex:
+                return list(ex.map(_dispatch, tasks))
+        except Exception as e:
+            print(f"⚠️ Parallell bilageparsning misslyckades ({e}) – kör seriellt")
+    return [_dispatch(t) for t in tasks]
+
+
 def parse_attachments(attachments: List[Dict[str, Any]], provider_hint: str = "") -> Dict[str, List]:
     """
     Tar en lista av bilagor (filename, content_type, data) och returnerar:
@@ -192,32 +472,23 @@ def parse_attachments(attachments: List[Dict[str, Any]], provider_hint: str = ""
         "rows":  [ … normaliserade rader (dict) från Excel/CSV … ],
         "texts": [ … textblobs (PDF/DOCX) som kan skickas till LLM … ]
       }
+    Flera bilagor tolkas parallellt; rader/texter slås ihop i bilagornas ordning.
     """
     rows: List[dict] = []
     texts: List[str] = []
 
+    tasks: List[Tuple[str, str, bytes]] = []
     for att in attachments:
-        name = (att.get("filename") or "").lower()
-        ctype = (att.get("content_type") or "").lower()
         data = att.get("data")
-
         if not data:
             continue
+        kind = _classify((att.get("filename") or "").lower(), (att.get("content_type") or "").lower())
+        if kind is not None:
+            tasks.append((kind, att.get("filename"), data))
 
-        try:
-            if name.endswith((".xlsx", ".xlsm", ".xls")) or "excel" in ctype:
-                rows.extend(_parse_excel(data))
-            elif name.endswith(".csv") or "csv" in ctype:
-                rows.extend(_parse_csv(data))
-            elif name.endswith(".docx") or "word" in ctype:
-                texts.extend(_parse_docx_to_texts(data))
-            elif name.endswith(".pdf") or "pdf" in ctype:
-                texts.extend(_parse_pdf_to_texts(data))
-            else:
-                # okänd typ – gör inget (eller lägg logik för .zip osv.)
-                pass
-        except Exception as e:
-            print(f"⚠️ Kunde inte tolka bilagan {att.get('filename')}: {e}")
+    for r, t in _dispatch_all(tasks):
+        rows.extend(r)
+        texts.extend(t)
 
     # sätt provider-hint om möjligt
     for r in rows:
@@ -10,80 +10,236 @@ This module does NOT parse attachment content — it only exposes it for others
 
 
 import os
+from collections import OrderedDict
 from email import policy
 from email.parser import BytesParser
-from typing import Iterator, Dict, Any
-
-
-def _extract_body(msg) -> str:
-    # text/plain i första hand (ej bilagor)
-    if msg.is_multipart():
-        for part in msg.walk():
-            ctype = part.get_content_type()
-            cd = (part.get("Content-Disposition") or "").lower()
-            if ctype == "text/plain" and "attachment" not in cd:
-                try:
-                    return part.get_content()
-                except Exception:
-                    pass
-        # fallback: ta HTML-innehåll om bara det finns
-        for part in msg.walk():
-            if part.get_content_type() == "text/html":
-                try:
-                    return part.get_content()
-                except Exception:
-                    pass
-        return ""
-    else:
-        try:
-            return msg.get_content()
-        except Exception:
-            return ""
+from typing import Iterator, Dict, Any, List, Optional, Tuple
+
+# Rust-baserad parser (PyO3) – betydligt snabbare än stdlib; stdlib används som fallback
+try:
+    from fast_mail_parser import parse_email
+except ImportError:
+    parse_email = None
+
+# HTML -> text för mail som bara har HTML-kropp: selectolax (lexbor, C) i första hand,
+# BeautifulSoup som fallback, annars skickas rå HTML vidare som förut
+try:
+    from selectolax.lexbor import LexborHTMLParser
+except ImportError:
+    LexborHTMLParser = None
+try:
+    from bs4 import BeautifulSoup
+except ImportError:
+    BeautifulSoup = None
 
+_BLOCK_TAGS = ("br", "p", "div", "tr", "li", "table", "h1", "h2", "h3", "h4", "h5", "h6")
+_CELL_TAGS = ("td", "th")
 
-def _extract_attachments(msg):
+
+def _html_to_text(html: str) -> str:
+    """Text ur HTML: blockelement blir radbrytningar, tabellceller tabbar (så tabeller förblir läsbara)."""
+    if LexborHTMLParser is not None:
+        tree = LexborHTMLParser(html)
+        for node in tree.css("script, style"):
+            node.decompose()
+        for node in tree.css(", ".join(_BLOCK_TAGS)):
+            node.insert_after("\n")
+        for node in tree.css(", ".join(_CELL_TAGS)):
+            node.insert_after("\t")
+        root = tree.body or tree.root
+        return root.text(separator="").strip() if root is not None else ""
+    if BeautifulSoup is not None:
+        soup = BeautifulSoup(html, "html.parser")
+        for tag in soup(["script", "style"]):
+            tag.decompose()
+        for tag in soup.find_all(_BLOCK_TAGS):
+            tag.insert_after("\n")
+        for tag in soup.find_all(_CELL_TAGS):
+            tag.insert_after("\t")
+        return soup.get_text().strip()
+    return html
+
+
+def _extract(msg) -> Tuple[str, List[Dict[str, Any]]]:
     """
-    Returnera lista av bilagor: dicts med keys:
-      filename, content_type, data(bytes)
+    Ett enda svep över MIME-trädet. Returnerar (body, attachments):
+    - body: första text/plain som inte är bilaga, annars första HTML-del (avkodas och
+      görs om till text först när den behövs), annars "".
+    - attachments: dicts med keys filename, content_type, data(bytes)
     """
-    files = []
     if not msg.is_multipart():
-        return files
+        try:
+            content = msg.get_content()
+        except Exception:
+            return "", []
+        if msg.get_content_type() == "text/html":
+            content = _html_to_text(content)
+        return content, []
 
+    body = None
+    html_parts = []
+    files = []
     for part in msg.walk():
+        ctype = part.get_content_type()
         cd = (part.get("Content-Disposition") or "").lower()
         if "attachment" in cd:
-            fname = part.get_filename() or "attachment"
-            ctype = part.get_content_type()
             data = part.get_payload(decode=True)  # bytes
             if data:
                 files.append({
-                    "filename": fname,
+                    "filename": part.get_filename() or "attachment",
                     "content_type": ctype,
                     "data": data,
                 })
-    return files
+        elif body is None and ctype == "text/plain":
+            # text/plain i första hand (ej bilagor)
+            try:
+                body = part.get_content()
+            except Exception:
+                pass
+        if ctype == "text/html" and body is None:
+            html_parts.append(part)
+
+    if body is None:
+        # fallback: ta HTML-innehåll om bara det finns
+        for part in html_parts:
+            try:
+                body = _html_to_text(part.get_content())
+                break
+            except Exception:
+                pass
+    return body or "", files
 
 
-def iter_eml_messages(root_dir: str) -> Iterator[Dict[str, Any]]:
+def _parse_fast(payload: bytes) -> Dict[str, Any]:
     """
-    Itererar över alla .eml-filer i en katalog och yieldar dict:
-      { filename, body:str, attachments:list[ {filename, content_type, data} ] }
+    Tolka .eml-bytes med fast_mail_parser till samma form som stdlib-vägen:
+      { body:str, attachments:list[ {filename, content_type, data} ] }
     """
-    if not os.path.isdir(root_dir):
-        return
+    mail = parse_email(payload)
+    # text/plain i första hand, annars HTML
+    if mail.text_plain:
+        body = mail.text_plain[0]
+    elif mail.text_html:
+        body = _html_to_text(mail.text_html[0])
+    else:
+        body = ""
 
-    for name in sorted(os.listdir(root_dir)):
-        if not name.lower().endswith(".eml"):
+    files = []
+    for att in mail.attachments:
+        # samma urval som stdlib-vägen: bara delar med Content-Disposition: attachment
+        if "attachment" not in (att.disposition or "").lower():
             continue
-        path = os.path.join(root_dir, name)
+        data = bytes(att.content) if att.content else b""
+        if data:
+            files.append({
+                "filename": att.filename or "attachment",
+                "content_type": (att.mimetype or "").lower(),
+                "data": data,
+            })
+    return {"body": body, "attachments": files}
+
+
+def _parse_stdlib(payload: bytes) -> Dict[str, Any]:
+    msg = BytesParser(policy=policy.default).parsebytes(payload)
+    body, attachments = _extract(msg)
+    return {"body": body, "attachments": attachments}
+
+
+# Större .eml än så här läses inte alls (stdlib-parsern kan behöva ~9x filstorleken i minne)
+EML_MAX_BYTES = int(float(os.getenv("EML_MAX_MB", "50")) * 1024 * 1024)
+
+
+# Valfri cache för tolkade mail (LRU per sökväg, begränsad i bytes med filstorleken som
+# mått): en oförändrad fil tolkas inte om när katalogen läses igen i samma process.
+# Av som standard (EML_CACHE_MB=0) – pipelinen läser varje fil en gång, i en worker.
+_EML_CACHE: "OrderedDict[str, Tuple[int, int, Dict[str, Any]]]" = OrderedDict()
+_EML_CACHE_MAX_BYTES = int(float(os.getenv("EML_CACHE_MB", "0")) * 1024 * 1024)
+_EML_CACHE_MAX_FILE = 2 * 1024 * 1024
+_eml_cache_bytes = 0
+
+
+def _eml_cache_put(path: str, mtime_ns: int, size: int, parsed: Dict[str, Any]) -> None:
+    global _eml_cache_bytes
+    old = _EML_CACHE.pop(path, None)
+    if old is not None:
+        _eml_cache_bytes -= old[1]  # äldre version av samma fil
+    _EML_CACHE[path] = (mtime_ns, size, parsed)
+    _eml_cache_bytes += size
+    while _eml_cache_bytes > _EML_CACHE_MAX_BYTES:
+        _, (_, old_size, _) = _EML_CACHE.popitem(last=False)
+        _eml_cache_bytes -= old_size
+
+
+def _eml_cache_clear() -> None:
+    global _eml_cache_bytes
+    _EML_CACHE.clear()
+    _eml_cache_bytes = 0
+
+
+def list_eml_paths(root_dir: str) -> List[str]:
+    """Sökvägar till alla .eml-filer i en katalog, sorterade på filnamn."""
+    if not os.path.isdir(root_dir):
+        return []
+    # scandir: filtyp från katalogposten (ingen extra stat per namn)
+    with os.scandir(root_dir) as it:
+        entries = sorted((e for e in it if e.name.lower().endswith(".eml")), key=lambda e: e.name)
+    paths = []
+    for entry in entries:
         try:
-            with open(path, "rb") as f:
-                msg = BytesParser(policy=policy.default).parse(f)
-            yield {
-                "filename": name,
-                "body": _extract_body(msg),
-                "attachments": _extract_attachments(msg),
-            }
-        except Exception as e:
-            print(f"⚠️ Hoppar över {name}: {e}")
+            if entry.is_file():
+                paths.append(entry.path)
+        except OSError as e:
+            print(f"⚠️ Hoppar över {entry.name}: {e}")
+    return paths
+
+
+def read_eml_message(path: str, use_cache: bool = True) -> Optional[Dict[str, Any]]:
+    """
+    Läser och tolkar en .eml-fil:
+      { filename, body:str, attachments:list[ {filename, content_type, data} ] }
+    Returnerar None (med varning) om filen är större än EML_MAX_MB eller inte kan läsas.
+    use_cache=False går förbi cachen (EML_CACHE_MB) helt.
+    """
+    name = os.path.basename(path)
+    try:
+        st = os.stat(path)
+        size = st.st_size
+        if size > EML_MAX_BYTES:
+            print(f"⚠️ Hoppar över {name}: {size / (1024 * 1024):.1f} MB > EML_MAX_MB")
+            return None
+        use_cache = use_cache and _EML_CACHE_MAX_BYTES > 0
+        if use_cache:
+            hit = _EML_CACHE.get(path)
+            if hit is not None and hit[:2] == (st.st_mtime_ns, size):
+                _EML_CACHE.move_to_end(path)
+                return {"filename": name, **hit[2]}
+        with open(path, "rb") as f:
+            payload = f.read()
+        parsed = None
+        if parse_email is not None:
+            try:
+                parsed = _parse_fast(payload)
+            except Exception:
+                parsed = None  # t.ex. ParseError – försök med stdlib
+        if parsed is None:
+            parsed = _parse_stdlib(payload)
+        del payload  # rå-bytes behövs inte längre
+        if use_cache and size <= _EML_CACHE_MAX_FILE:
+            _eml_cache_put(path, st.st_mtime_ns, size, parsed)
+        return {"filename": name, **parsed}
+    except Exception as e:
+        print(f"⚠️ Hoppar över {name}: {e}")
+        return None
+
+
+def iter_eml_messages(root_dir: str) -> Iterator[Dict[str, Any]]:
+    """
+    Itererar över alla .eml-filer i en katalog och yieldar dict (se read_eml_message).
+    Ett mail i taget hålls i minnet (plus högst EML_CACHE_MB tolkade mail om
+    cachen är påslagen). Filer större än EML_MAX_MB hoppas över.
+    """
+    for path in list_eml_paths(root_dir):
+        msg = read_eml_message(path)
+        if msg is not None:
+            yield msg
+            del msg
@@ -3,7 +3,8 @@ Fetch recent messages from a Microsoft 365 shared mailbox and save them as .eml
 
 Uses MSAL (client credentials) + Microsoft Graph:
 - Lists messages from a folder (e.g., Inbox) within a date window (e.g., last N days).
-- Downloads each message in MIME format to a local folder for the parser pipeline.
+- Downloads each message in MIME format to a local folder for the parser pipeline
+  (several at a time over one HTTP session; 429/503 are retried after Retry-After).
 
 Requires:
 - Azure App Registration with Graph Application permission "Mail.Read" and admin consent.
@@ -19,14 +20,19 @@ import re
 import time
 import json
 import shutil
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
-from typing import List, Dict, Optional
+from functools import lru_cache
+from typing import List, Dict, Optional, Tuple
 
 import requests
+from requests.adapters import HTTPAdapter
 from msal import ConfidentialClientApplication
 
 
 GRAPH_BASE = "https://graph.microsoft.com/v1.0"
+_DOWNLOAD_WORKERS = 8  # parallella MIME-hämtningar
+_MAX_RETRIES = 5       # vid 429/503 (throttling)
 
 
 def _iso_utc_days_back(days_back: int) -> str:
@@ -39,33 +45,78 @@ def _sanitize_filename(s: str) -> str:
     return s[:180]  # försiktigt med path-limitar
 
 
-def _get_token(tenant_id: str, client_id: str, client_secret: str) -> str:
-    app = ConfidentialClientApplication(
+@lru_cache(maxsize=8)
+def _get_app(tenant_id: str, client_id: str, client_secret: str) -> ConfidentialClientApplication:
+    """
+    En app-instans per (tenant, klient, hemlighet) under processens livstid: MSAL:s
+    inbyggda token-cache lever i instansen, så en giltig token återanvänds utan nätverksanrop.
+    """
+    return ConfidentialClientApplication(
         client_id=client_id,
         client_credential=client_secret,
         authority=f"https://login.microsoftonline.com/{tenant_id}",
     )
-    # Client credentials => scope ".default"
+
+
+def _get_token(tenant_id: str, client_id: str, client_secret: str) -> str:
+    app = _get_app(tenant_id, client_id, client_secret)
+    # Client credentials => scope ".default" (svaras ur app-cachen tills token löper ut)
     result = app.acquire_token_for_client(scopes=["https://graph.microsoft.com/.default"])
     if "access_token" not in result:
         raise RuntimeError(f"Failed to get token: {result}")
     return result["access_token"]
 
 
-def _graph_get(url: str, token: str, params: Optional[Dict] = None) -> Dict:
+def _session() -> requests.Session:
+    """En Session (återanvänder TCP/TLS) med plats för alla parallella nedladdningar."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=16, pool_maxsize=16)
+    session.mount("https://", adapter)
+    return session
+
+
+def _get_with_retry(session: requests.Session, url: str, token: str,
+                    params: Optional[Dict] = None, timeout: int = 60, stream: bool = False) -> requests.Response:
+    """GET som respekterar Graph-throttling: vid 429/503 väntar vi Retry-After (eller backoff) och försöker igen."""
     headers = {"Authorization": f"Bearer {token}"}
-    resp = requests.get(url, headers=headers, params=params, timeout=60)
+    for attempt in range(_MAX_RETRIES + 1):
+        resp = session.get(url, headers=headers, params=params, timeout=timeout, stream=stream)
+        if resp.status_code not in (429, 503) or attempt == _MAX_RETRIES:
+            return resp
+        retry_after = resp.headers.get("Retry-After", "")
+        wait = float(retry_after) if retry_after.isdigit() else min(2 ** attempt, 30)
+        resp.close()
+        time.sleep(wait)
+    return resp
+
+
+def _graph_get(session: requests.Session, url: str, token: str, params: Optional[Dict] = None) -> Dict:
+    resp = _get_with_retry(session, url, token, params=params)
     if not resp.ok:
         raise RuntimeError(f"Graph GET {url} failed: {resp.status_code} {resp.text[:500]}")
     return resp.json()
 
 
-def _graph_get_bytes(url: str, token: str) -> bytes:
-    headers = {"Authorization": f"Bearer {token}"}
-    resp = requests.get(url, headers=headers, timeout=120)
-    if not resp.ok:
-        raise RuntimeError(f"Graph GET bytes {url} failed: {resp.status_code} {resp.text[:500]}")
-    return resp.content
+def _graph_download(session: requests.Session, url: str, token: str, fpath: str) -> None:
+    """
+    Strömmar svaret till fpath i bitar om 64 KB – hela .eml:en hålls aldrig i minnet.
+    Skrivs först till fpath + ".part" så att en avbruten hämtning inte lämnar en halv .eml.
+    """
+    with _get_with_retry(session, url, token, timeout=120, stream=True) as resp:
+        if not resp.ok:
+            raise RuntimeError(f"Graph GET bytes {url} failed: {resp.status_code} {resp.text[:500]}")
+        tmp = fpath + ".part"
+        try:
+            with open(tmp, "wb") as f:
+                for chunk in resp.iter_content(chunk_size=65536):
+                    f.write(chunk)
+            os.replace(tmp, fpath)
+        except BaseException:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            raise
 
 
 def fetch_shared_mailbox_to_folder(
@@ -101,32 +152,36 @@ def fetch_shared_mailbox_to_folder(
         "$top": top,
     }
 
-    saved_files: List[str] = []
-
-    while True:
-        data = _graph_get(url, token, params=params)
-        params = None  # endast första callen använder params
-
-        for item in data.get("value", []):
-            mid = item["id"]
-            subject = item.get("subject") or "no_subject"
-            received = item.get("receivedDateTime") or ""
-            # 2) Hämta rå MIME (.eml)
-            eml_bytes = _graph_get_bytes(f"{GRAPH_BASE}/users/{shared_mailbox}/messages/{mid}/$value", token)
-
-            # 3) Spara till fil
-            ts = received.replace(":", "").replace("-", "")
-            fname = _sanitize_filename(f"{ts}_{subject}_{mid}.eml")
-            fpath = os.path.join(dest_folder, fname)
-            with open(fpath, "wb") as f:
-                f.write(eml_bytes)
-            saved_files.append(fpath)
-
-        next_link = data.get("@odata.nextLink")
-        if not next_link:
-            break
-        # Graph throttling safety
-        time.sleep(0.4)
-        url = next_link
+    with _session() as session:
+        # 2) Samla alla meddelanden först (sidvis), hämta sedan MIME parallellt
+        jobs: List[Tuple[str, str]] = []  # (MIME-url, filväg)
+        while True:
+            data = _graph_get(session, url, token, params=params)
+            params = None  # endast första callen använder params
+
+            for item in data.get("value", []):
+                mid = item["id"]
+                subject = item.get("subject") or "no_subject"
+                received = item.get("receivedDateTime") or ""
+                ts = received.replace(":", "").replace("-", "")
+                fname = _sanitize_filename(f"{ts}_{subject}_{mid}.eml")
+                jobs.append((f"{GRAPH_BASE}/users/{shared_mailbox}/messages/{mid}/$value",
+                             os.path.join(dest_folder, fname)))
+
+            next_link = data.get("@odata.nextLink")
+            if not next_link:
+                break
+            # Graph throttling safety
+            time.sleep(0.4)
+            url = next_link
+
+        # 3) Rå MIME (.eml) direkt till fil, _DOWNLOAD_WORKERS åt gången över samma Session
+        def _download(job: Tuple[str, str]) -> str:
+            mime_url, fpath = job
+            _graph_download(session, mime_url, token, fpath)
+            return fpath
+
+        with ThreadPoolExecutor(max_workers=_DOWNLOAD_WORKERS) as ex:
+            saved_files: List[str] = list(ex.map(_download, jobs))
 
     return saved_files
@@ -14,9 +14,12 @@ This module focuses on a tiny "send or save" contract to keep the app logic simp
 
 
 import os
+import shutil
 import smtplib
 from email.message import EmailMessage
 from datetime import datetime
+from pathlib import Path
+from typing import BinaryIO
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -30,21 +33,40 @@ SMTP_TO = [s.strip() for s in os.getenv("SMTP_TO", "").split(",") if s.strip()]
 SMTP_STARTTLS = os.getenv("SMTP_STARTTLS", "true").lower() in ("1", "true", "yes")
 
 DRY_RUN = os.getenv("DRY_RUN", "false").lower() in ("1", "true", "yes")
+OUTBOX_DIR = Path("logs/outbox")
 
 
-def send_email(subject: str, html_body: str, to: list[str] | None = None):
+def send_email(subject: str, html_body: str | None = None, to: list[str] | None = None,
+               html_body_file: BinaryIO | None = None):
     """
     Skickar HTML-mail – eller sparar till fil om DRY_RUN=true.
+    HTML ges antingen som str (html_body) eller som en binär fil med UTF-8 (html_body_file);
+    i DRY_RUN strömmas filen direkt till outbox utan att läsas in i minnet.
     """
+    if html_body is None and html_body_file is None:
+        raise ValueError("send_email kräver html_body eller html_body_file")
+
     if DRY_RUN or not SMTP_HOST or not (SMTP_TO or to):
-        os.makedirs("logs/outbox", exist_ok=True)
         ts = datetime.now().strftime("%Y%m%d_%H%M%S")
-        path = f"logs/outbox/summary_{ts}.html"
-        with open(path, "w", encoding="utf-8") as f:
-            f.write(html_body)
+        path = OUTBOX_DIR / f"summary_{ts}.html"
+        try:
+            f = path.open("wb")
+        except FileNotFoundError:
+            # katalogen skapas bara när den saknas (inte en mkdir per anrop)
+            OUTBOX_DIR.mkdir(parents=True, exist_ok=True)
+            f = path.open("wb")
+        with f:
+            if html_body_file is not None:
+                shutil.copyfileobj(html_body_file, f)
+            else:
+                f.write(html_body.encode("utf-8"))
         print(f"💾 DRY-RUN: sparade e-post som HTML: {path}")
         return
 
+    if html_body is None:
+        # SMTP-meddelandet byggs ändå i minnet; läs filen en gång här
+        html_body = html_body_file.read().decode("utf-8")
+
     recipients = to or SMTP_TO
     msg = EmailMessage()
     msg["Subject"] = subject
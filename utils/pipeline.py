@@ -0,0 +1,324 @@
+"""
+Pipeline steps used by app.py.
+
+What’s here:
+- process_dir(): .eml -> normalized price rows (emails and attachments parsed in parallel,
+  LLM texts sent in batch or as an async Gemini batch job).
+- diff_with_analyzer(): compare today's rows with the previous snapshot via
+  utils.price_analyzer and adapt the result to render_diff_html()'s shape.
+- render_diff_html(): stream the HTML summary as UTF-8 into a binary file/buffer.
+
+app.py only holds config (paths, Graph fetch) and wires these together in main().
+"""
+
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Any, BinaryIO, Iterator, List, Dict, Tuple, Optional
+
+from html import escape
+
+from utils.email_reader import list_eml_paths, read_eml_message
+from utils.attachment_parser import parse_attachments
+from utils.price_analyzer import compare_indexed
+from llm.extractor import extract_sms_prices_llm_batch, extract_sms_prices_llm_batch_job
+
+
+# ---------- Extrahera ----------
+_WS_RE = re.compile(r"\s+")
+
+
+def _norm_text(text: str) -> str:
+    return _WS_RE.sub(" ", text).strip().lower()
+
+
+def _process_one(path: str) -> Optional[Dict]:
+    """
+    CPU-delen för ett mail (mail- och bilageparsning). Körs i en worker-process:
+    bara sökvägen skickas dit, mailet läses och tolkas i workern.
+    Returnerar { filename, provider_hint, body, rows, texts } – LLM-anropen görs
+    sedan samlat i process_dir – eller None om filen hoppades över.
+    """
+    msg = read_eml_message(path, use_cache=False)  # varje fil läses en gång, i en worker
+    if msg is None:
+        return None
+    filename = msg["filename"]
+    provider_hint = os.path.splitext(filename)[0]
+    body = msg["body"]
+    parsed = {"rows": [], "texts": []}
+    if msg["attachments"]:
+        parsed = parse_attachments(msg["attachments"], provider_hint=provider_hint)
+
+    # Kroppen är ofta samma prislista som den bifogade PDF/DOCX:en – om kroppens
+    # text (normaliserad) redan finns i en bilagetext räcker det att LLM:a bilagan.
+    # Jämförs med mellanslag runt om så att bara hela ord matchar ("0.05" finns inte i "0.055").
+    if body and parsed["texts"]:
+        norm_body = _norm_text(body)
+        if norm_body and any(f" {norm_body} " in f" {_norm_text(t)} " for t in parsed["texts"]):
+            print(f"↪️  {filename}: mailkroppen finns redan i bilagan – hoppar över kroppen")
+            body = None
+
+    return {
+        "filename": filename,
+        "provider_hint": provider_hint,
+        "body": body,
+        "rows": parsed["rows"],
+        "texts": parsed["texts"],
+    }
+
+
+def _process_all(paths: List[str]) -> List[Dict]:
+    """Kör _process_one över alla mail, parallellt i processer om det finns fler än ett."""
+    workers = int(os.getenv("PIPELINE_WORKERS", "0")) or (os.cpu_count() or 1)
+    workers = min(workers, len(paths))
+    results = None
+    if workers > 1:
+        try:
+            with ProcessPoolExecutor(max_workers=workers) as ex:
+                results = list(ex.map(_process_one, paths, chunksize=4))
+        except Exception as e:
+            print(f"⚠️ Parallell bearbetning misslyckades ({e}) – kör seriellt")
+    if results is None:
+        results = [_process_one(p) for p in paths]
+    return [r for r in results if r is not None]
+
+
+def process_dir(email_dir: str) -> Iterator[Dict]:
+    """
+    Går igenom alla .eml i en katalog och extraherar normaliserade prisrader.
+    - Mailkropp -> LLM
+    - Bilagor: Excel/CSV -> rader direkt; PDF/DOCX -> textblock -> LLM
+    Mail och bilagor tolkas parallellt per fil (_process_one). Alla LLM-texter samlas
+    sedan och skickas i batch (extract_sms_prices_llm_batch), eller som ett
+    asynkront batch-jobb om USE_BATCH_LLM=true.
+    Raderna yieldas i ursprunglig ordning. Alla rader finns i minnet innan den första
+    yieldas (LLM-svaren kommer samlat); generatorn sparar bara en sammanslagen kopia.
+    """
+    if not os.path.isdir(email_dir):
+        print(f"❌ Hittar inte katalogen: {email_dir}")
+        return
+
+    # Segment i ursprunglig ordning: färdiga rader (list) eller index (int) i llm_items
+    segments: List = []
+    llm_items: List[Tuple[Optional[str], str]] = []
+    llm_keys: List[str] = []  # stabila custom_ids: filnamn|källa|index
+
+    def _queue_llm(text: str, provider_hint: str, key: str) -> None:
+        segments.append(len(llm_items))
+        llm_items.append((provider_hint, text))
+        llm_keys.append(key)
+
+    for res in _process_all(list_eml_paths(email_dir)):
+        filename = res["filename"]
+        provider_hint = res["provider_hint"]
+        body = res["body"]
+
+        print(f"\n📨 Behandlar: {filename}")
+
+        # 1) Kropp -> LLM
+        if body and body.strip():
+            _queue_llm(body, provider_hint, f"{filename}|body|0")
+
+        # 2) Bilagor: Excel/CSV redan strukturerat, PDF/DOCX -> LLM
+        segments.append(res["rows"])
+        for i, blob in enumerate(res["texts"]):
+            _queue_llm(blob, provider_hint, f"{filename}|attachment|{i}")
+
+    llm_rows: List[List[Dict]] = []
+    if llm_items:
+        use_batch_llm = os.getenv("USE_BATCH_LLM", "false").lower() in ("1", "true", "yes")
+        if use_batch_llm:
+            llm_rows = extract_sms_prices_llm_batch_job(llm_items, custom_ids=llm_keys)
+        else:
+            llm_rows = extract_sms_prices_llm_batch(llm_items)
+    for seg in segments:
+        yield from (llm_rows[seg] if isinstance(seg, int) else seg)
+
+
+# ---------- Mailrender ----------
+def _fmt(v):
+    if v is None:
+        return ""
+    if isinstance(v, float):
+        return f"{v:.6f}"
+    # escape to avoid accidental HTML injection from supplier text
+    return escape(str(v))
+
+
+def _fmt_str(v):
+    """Textkolumner: nästan alltid str eller None, så de testas först."""
+    if v is None:
+        return ""
+    if type(v) is str:
+        return escape(v)
+    return _fmt(v)
+
+
+def _fmt_price(v):
+    """Priskolumner: _price_any ger alltid float eller None."""
+    return "" if v is None else f"{v:.6f}"
+
+
+_STYLE = """
+    <style>
+      body {font-family: system-ui, -apple-system, Segoe UI, Roboto, Arial, sans-serif;}
+      table {border-collapse: collapse; width: 100%;}
+      th, td {border: 1px solid #ddd; padding: 6px; font-size: 12px;}
+      th {background: #f5f5f5; text-align: left;}
+      h2 {margin: 18px 0 6px;}
+      .small {color: #666; font-size: 12px;}
+    </style>"""
+
+_TABLE_HEAD = """
+      <h2>{title}</h2>
+      <table><thead><tr>
+        <th>Provider</th><th>Country</th><th>Network/Operator</th><th>MCC</th><th>MNC</th>
+        <th>Old</th><th>New</th><th>Currency</th><th>Effective From</th><th>Direction</th>
+      </tr></thead><tbody>"""
+
+_TABLE_TAIL = "</tbody></table>\n"
+
+_ROW_TEMPLATE = """
+        <tr>
+          <td>{provider}</td>
+          <td>{country}</td>
+          <td>{network}</td>
+          <td>{mcc}</td>
+          <td>{mnc}</td>
+          <td style="text-align:right">{old}</td>
+          <td style="text-align:right">{new}</td>
+          <td>{currency}</td>
+          <td>{effective_from}</td>
+          <td>{direction}</td>
+        </tr>"""
+
+
+def _row_ctx(rec, old, newv, direction) -> Dict[str, str]:
+    """Formaterade (escapade) cellvärden för _ROW_TEMPLATE, beräknade en gång per rad."""
+    r = rec or {}
+    get = r.get
+    return {
+        "provider": _fmt_str(get("provider")),
+        "country": _fmt_str(get("country")),
+        "network": _fmt_str(get("network") or get("operator")),
+        "mcc": _fmt_str(get("mcc")),
+        "mnc": _fmt_str(get("mnc")),
+        "old": _fmt_price(old),
+        "new": _fmt_price(newv),
+        "currency": _fmt_str(get("currency")),
+        "effective_from": _fmt_str(get("effective_from")),
+        "direction": escape(direction),
+    }
+
+
+def _write_table(write, title: str, ctxs, empty_text: str) -> None:
+    write(_TABLE_HEAD.format(title=title))
+    fill = _ROW_TEMPLATE.format_map
+    first = True
+    for ctx in ctxs:
+        if not first:
+            write("\n")
+        write(fill(ctx))
+        first = False
+    if first:
+        write(f'<tr><td colspan="10">{empty_text}</td></tr>')
+    write(_TABLE_TAIL)
+
+
+def render_diff_html(diff: Dict[str, List[Dict]], out: BinaryIO, report_date: str) -> None:
+    """
+    Skriver HTML-rapporten som UTF-8 direkt till out (binär fil/buffert), rad för rad,
+    så att hela dokumentet aldrig byggs upp som en enda sträng.
+    """
+    ts = datetime.now().strftime("%Y-%m-%d %H:%M")
+    changed = diff["changed"]; new = diff["new"]; removed = diff["removed"]; unchanged_count = diff["unchanged_count"]
+
+    def write(text: str) -> None:
+        out.write(text.encode("utf-8"))
+
+    write(f"""
+    <html><head>{_STYLE}</head><body>
+      <h1>SMS Price Daily Summary – {report_date}</h1>
+      <p class="small">Generated {ts}</p>
+      <p><b>Summary:</b> Changed: {len(changed)} · New: {len(new)} · Removed: {len(removed)} · Unchanged pairs: {unchanged_count}</p>
+""")
+    _write_table(write, "Changed",
+                 (_row_ctx(c["today"] or c["prev"], c["old"], c["new"], c["direction"]) for c in changed),
+                 "No changes")
+    _write_table(write, "New entries",
+                 (_row_ctx(n["today"], n["old"], n["new"], "new") for n in new),
+                 "No new entries")
+    _write_table(write, "Removed entries",
+                 (_row_ctx(r["prev"], r["old"], r["new"], "removed") for r in removed),
+                 "No removed entries")
+    write("    </body></html>")
+
+
+# ---------- Diff ----------
+def _price_any(rec) -> Optional[float]:
+    if not isinstance(rec, dict):
+        return None
+    for k in ("new_price", "price", "rate", "current_rate", "previous_rate", "old_price"):
+        v = rec.get(k)
+        if isinstance(v, (int, float)):
+            return float(v)
+    return None
+
+
+def diff_with_analyzer(
+    today_map: Dict[str, Dict[str, Any]],
+    prev_map: Dict[str, Dict[str, Any]],
+) -> Dict[str, Any]:
+    """
+    Jämför dagens index mot föregående snapshot (utils.price_analyzer.compare_indexed)
+    och anpassar resultatet till render_diff_html():s format.
+    OBS: prev_map töms av compare_indexed.
+    """
+    diff_core = compare_indexed(today_map, prev_map)
+    # diff_core = {"changed":[{"before":..,"after":..,"delta":..},...],
+    #              "new":[...], "removed":[...], "summary":{"changed":N,"new":M,"removed":K}}
+
+    changed_adapted = []
+    for c in diff_core["changed"]:
+        before, after = c.get("before"), c.get("after")
+        old = _price_any(before)
+        newv = _price_any(after)
+        direction = "increase" if (old is not None and newv is not None and newv > old) else \
+                    "decrease" if (old is not None and newv is not None and newv < old) else "changed"
+        changed_adapted.append({
+            "key": None,
+            "today": after,
+            "prev": before,
+            "old": old,
+            "new": newv,
+            "delta": c.get("delta"),
+            "direction": direction,
+        })
+
+    new_adapted = [{
+        "key": None,
+        "today": n,
+        "prev": None,
+        "old": None,
+        "new": _price_any(n),
+        "delta": None,
+        "direction": "new",
+    } for n in diff_core["new"]]
+
+    removed_adapted = [{
+        "key": None,
+        "today": None,
+        "prev": r,
+        "old": _price_any(r),
+        "new": None,
+        "delta": None,
+        "direction": "removed",
+    } for r in diff_core["removed"]]
+
+    return {
+        "changed": changed_adapted,
+        "new": new_adapted,
+        "removed": removed_adapted,
+        "unchanged_count": 0,  # not tracked by price_analyzer; set to 0
+    }
@@ -2,10 +2,14 @@
 Price snapshots + diff utilities.
 
 Purpose:
-- Load previous snapshot (logs/latest.json) if it exists.
+- Load previous snapshot (logs/latest.jsonl) if it exists.
 - Compare today's rows vs previous rows to detect:
     Changed (price differs), New (not seen before), Removed (missing today).
-- Save today's snapshot (logs/parsed_YYYY-MM-DD.json) and update latest.json.
+- Save today's snapshot (logs/parsed_YYYY-MM-DD.jsonl) and update latest.jsonl.
+
+Format:
+- *.jsonl → one row per line (streamed on load, no full-document parse).
+- *.json  → legacy {"rows": [...]} / [...] documents are still read and written.
 """
 
 
@@ -13,9 +17,16 @@ Purpose:
 
 from __future__ import annotations
 
+import os
 import json
 from pathlib import Path
-from typing import Any, Dict, Iterable, List, Tuple
+from typing import Any, Dict, Iterable, Iterator, List, Tuple
+
+# orjson (C/Rust) är flera gånger snabbare än stdlib json; stdlib används som fallback
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 
 # -------- Helpers -------------------------------------------------------------
@@ -27,23 +38,104 @@ _COUNTRY_KEYS = ("country", "country_name", "countrynam")
 _MCC_KEYS = ("mcc",)
 _MNC_KEYS = ("mnc",)
 
+# Fältnamnen i vårt normaliserade radschema (extractor/attachment_parser): redan gemener
+# utan mellanslag, så för sådana rader är raden själv sin "gemener-karta" (ingen kopia).
+_PLAIN_KEYS = frozenset((
+    "provider", "country", "country_iso", "country_code", "operator", "network",
+    "mcc", "mnc", "imsi", "nnc", "number_type", "destination",
+    "previous_rate", "old_price", "current_rate", "new_price", "price",
+    "currency", "variation", "effective_from", "count", "cost",
+    "product_category", "notes",
+))
 
-def _first_value(d: Dict[str, Any], keys: Tuple[str, ...]) -> Any:
-    """Hitta första förekomsten av något av keys (case-insensitive)."""
+# Fältseparator i radnyckeln: ASCII Unit Separator förekommer inte i leverantörsdata,
+# till skillnad från "|" (t.ex. "Vodafone | Ziggo") som kunde ge krockande nycklar.
+_KEY_SEP = "\x1f"
+
+
+def _json_dumps(payload: Any) -> bytes:
+    if orjson is not None:
+        try:
+            return orjson.dumps(payload, option=orjson.OPT_INDENT_2)
+        except orjson.JSONEncodeError:
+            pass  # t.ex. numpy-typer/NaN-kantfall – låt stdlib försöka
+    return json.dumps(payload, ensure_ascii=False, indent=2).encode("utf-8")
+
+
+def _json_dumps_line(row: Dict[str, Any]) -> bytes:
+    if orjson is not None:
+        try:
+            return orjson.dumps(row, option=orjson.OPT_APPEND_NEWLINE)
+        except orjson.JSONEncodeError:
+            pass
+    return json.dumps(row, ensure_ascii=False).encode("utf-8") + b"\n"
+
+
+def _json_loads(raw: bytes) -> Any:
+    if orjson is not None:
+        try:
+            return orjson.loads(raw)
+        except orjson.JSONDecodeError:
+            pass  # t.ex. NaN-token i snapshots skrivna med stdlib json
+    return json.loads(raw)
+
+
+def _write_atomic(path: Path, data: bytes) -> None:
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_bytes(data)
+    os.replace(tmp, path)
+
+
+def _publish(src: Path, dest: Path, data: bytes) -> None:
+    """
+    Gör dest till en kopia av src utan att skriva om bytes: hård länk + atomiskt byte.
+    Faller tillbaka till att skriva data om filsystemet inte stöder hårda länkar.
+    """
+    try:
+        if src.samefile(dest):
+            return  # redan samma inod: rename(2) vore en no-op och lämnade kvar .tmp
+    except FileNotFoundError:
+        pass  # dest finns inte än
+    tmp = dest.with_name(dest.name + ".tmp")
+    try:
+        tmp.unlink(missing_ok=True)
+        os.link(src, tmp)
+    except OSError:
+        tmp.write_bytes(data)
+    os.replace(tmp, dest)
+
+
+def _lower_keys(d: Dict[str, Any]) -> Tuple[Dict[str, Any], List[Tuple[str, Any]]]:
+    """(nycklar i gemener -> värde, [(nyckel utan mellanslag, värde)] för nycklar med mellanslag)."""
+    if d.keys() <= _PLAIN_KEYS:
+        return d, []  # normaliserad rad: inget att göra om
     lower = {k.lower(): v for k, v in d.items()}
+    spaced = [(k.replace(" ", ""), v) for k, v in lower.items() if " " in k]
+    return lower, spaced
+
+
+def _first_value_lower(lower: Dict[str, Any], spaced: List[Tuple[str, Any]], keys: Tuple[str, ...]) -> Any:
+    """Som _first_value, men på en redan byggd _lower_keys(d) (en kopia per rad i stället för per fält)."""
     for k in keys:
         if k in lower:
             return lower[k]
     # prova trimma space i nycklar
-    for k, v in lower.items():
-        if k.replace(" ", "") in keys:
+    for k, v in spaced:
+        if k in keys:
             return v
     return None
 
 
+def _first_value(d: Dict[str, Any], keys: Tuple[str, ...]) -> Any:
+    """Hitta första förekomsten av något av keys (case-insensitive)."""
+    return _first_value_lower(*_lower_keys(d), keys)
+
+
 def _as_float(x: Any) -> float | None:
     if x is None:
         return None
+    if type(x) is float:
+        return x  # vanligaste fallet; samma värde som float(str(x))
     try:
         return float(str(x).strip().replace(",", "."))
     except Exception:
@@ -59,18 +151,19 @@ def _row_key(row: Dict[str, Any]) -> str:
     Bygg en robust nyckel för att identifiera en prisrad.
     Anpassa vid behov om ni har andra fält som bör ingå.
     """
-    country = _norm_str(_first_value(row, _COUNTRY_KEYS))
-    network = _norm_str(_first_value(row, _NETWORK_KEYS))
-    mcc = _norm_str(_first_value(row, _MCC_KEYS))
-    mnc = _norm_str(_first_value(row, _MNC_KEYS))
-    currency = _norm_str(_first_value(row, _CURRENCY_KEYS))
+    lower, spaced = _lower_keys(row)
+    country = _norm_str(_first_value_lower(lower, spaced, _COUNTRY_KEYS))
+    network = _norm_str(_first_value_lower(lower, spaced, _NETWORK_KEYS))
+    mcc = _norm_str(_first_value_lower(lower, spaced, _MCC_KEYS))
+    mnc = _norm_str(_first_value_lower(lower, spaced, _MNC_KEYS))
+    currency = _norm_str(_first_value_lower(lower, spaced, _CURRENCY_KEYS))
 
     # fallback om nätverksnamn saknas men operator finns
-    if not network and "operator" in {k.lower() for k in row.keys()}:
+    if not network and "operator" in lower:
         network = _norm_str(row.get("operator"))
 
     # bygg nyckel – ordning viktig men ganska tolerant
-    return "|".join([country, network, mcc, mnc, currency])
+    return _KEY_SEP.join((country, network, mcc, mnc, currency))
 
 
 def _price_of(row: Dict[str, Any]) -> float | None:
@@ -86,43 +179,85 @@ def _to_map(rows: Iterable[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
 
 # -------- Public API ----------------------------------------------------------
 
-def load_previous_prices(file_path: str | Path) -> List[Dict[str, Any]]:
+def index_prices(rows: Iterable[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], Dict[str, Dict[str, Any]]]:
     """
-    Läs in föregående snapshot (JSON). Returnerar tom lista om fil saknas.
+    Samlar rader från en iterator (t.ex. en generator) i ett enda svep och returnerar
+    (rader i ordning, {radnyckel: rad}) – indexet för compare_indexed byggs på vägen.
     """
-    p = Path(file_path)
+    out_rows: List[Dict[str, Any]] = []
+    out_map: Dict[str, Dict[str, Any]] = {}
+    for r in rows or []:
+        out_rows.append(r)
+        out_map[_row_key(r)] = r
+    return out_rows, out_map
+
+
+def _iter_snapshot(p: Path) -> Iterator[Dict[str, Any]]:
+    """Rader ur en snapshot (JSONL rad för rad, JSON som helt dokument). Fel propageras."""
     if not p.exists():
-        return []
+        return
+    if p.suffix == ".jsonl":
+        with p.open("rb") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    row = _json_loads(line)
+                except ValueError:
+                    continue  # t.ex. avbruten sista rad – hoppa över
+                if isinstance(row, dict):
+                    yield row
+        return
+
+    data = _json_loads(p.read_bytes())
+    # data kan vara {"date": "...", "rows": [...] } eller bara [...]
+    if isinstance(data, dict) and "rows" in data:
+        yield from data["rows"]
+    elif isinstance(data, list):
+        yield from data
+
+
+def load_previous_prices(file_path: str | Path) -> List[Dict[str, Any]]:
+    """
+    Läs in föregående snapshot (JSONL eller JSON). Returnerar tom lista om fil saknas.
+    JSONL läses rad för rad, så hela filen hålls aldrig i minnet som text.
+    """
     try:
-        with p.open("r", encoding="utf-8") as f:
-            data = json.load(f)
-        # data kan vara {"date": "...", "rows": [...] } eller bara [...]
-        if isinstance(data, dict) and "rows" in data:
-            return list(data["rows"])
-        elif isinstance(data, list):
-            return data
-        else:
-            return []
+        return list(_iter_snapshot(Path(file_path)))
     except Exception:
         # hellre tom lista än att krascha i produktion
         return []
 
 
-def save_current_prices(current_prices: List[Dict[str, Any]], file_path: str | Path) -> None:
+def load_previous_index(file_path: str | Path) -> Dict[str, Dict[str, Any]]:
+    """
+    Som load_previous_prices men bygger bara indexet {radnyckel: rad} för compare_indexed,
+    direkt från strömmen – ingen radlista. Tomt index om filen saknas eller inte kan läsas.
+    """
+    try:
+        return _to_map(_iter_snapshot(Path(file_path)))
+    except Exception:
+        return {}
+
+
+def save_current_prices(current_prices: Iterable[Dict[str, Any]], file_path: str | Path) -> None:
     """
-    Spara dagens snapshot som JSON. Skapar kataloger vid behov.
-    Uppdaterar också en syskonfil 'latest.json'.
+    Spara dagens snapshot. Skapar kataloger vid behov.
+    *.jsonl skrivs som en rad per prisrad, annars som JSON {"rows": [...]}.
+    Uppdaterar också en syskonfil 'latest' med samma filändelse (hård länk till snapshoten).
+    Båda filerna byts atomiskt, så en läsare ser aldrig en halvskriven fil.
     """
     p = Path(file_path)
     p.parent.mkdir(parents=True, exist_ok=True)
-    payload = {"rows": list(current_prices)}
-    with p.open("w", encoding="utf-8") as f:
-        json.dump(payload, f, ensure_ascii=False, indent=2)
+    if p.suffix == ".jsonl":
+        data = b"".join(_json_dumps_line(r) for r in current_prices)
+    else:
+        data = _json_dumps({"rows": list(current_prices)})
+    _write_atomic(p, data)
 
-    # uppdatera latest.json i samma katalog
-    latest = p.parent / "latest.json"
-    with latest.open("w", encoding="utf-8") as f:
-        json.dump(payload, f, ensure_ascii=False, indent=2)
+    # uppdatera latest.jsonl / latest.json i samma katalog (samma bytes, kodas inte om)
+    latest = p.parent / f"latest{p.suffix}"
+    _publish(p, latest, data)
 
 
 def compare_prices(
@@ -138,34 +273,55 @@ def compare_prices(
         "summary": {"changed": N, "new": M, "removed": K}
       }
     """
-    cur_map = _to_map(current_prices)
-    prev_map = _to_map(previous_prices)
+    if current_prices is previous_prices:
+        # samma snapshot två gånger (tester, omkörningar): inget kan skilja – bygg inga index
+        return compare_indexed({}, {})
+    return compare_indexed(_to_map(current_prices), _to_map(previous_prices))
+
 
+def compare_indexed(
+    cur_map: Dict[str, Dict[str, Any]],
+    prev_map: Dict[str, Dict[str, Any]],
+) -> Dict[str, Any]:
+    """
+    Som compare_prices, men på redan indexerade rader ({radnyckel: rad}, se index_prices),
+    så att indexet inte behöver byggas om. OBS: prev_map töms (matchade nycklar plockas ut).
+    Ett svep över cur_map + det som blir kvar i prev_map, dvs. O(N+M) utan mängdoperationer.
+    """
+    if cur_map is prev_map:
+        prev_map = {}  # samma index: allt är oförändrat (och prev_map får inte tömmas under svepet)
+        cur_map = {}
     changed: List[Dict[str, Any]] = []
     new: List[Dict[str, Any]] = []
     removed: List[Dict[str, Any]] = []
 
-    # new + changed
+    # lokala alias: slipper attribut-/globaluppslag per rad i loopen
+    prev_pop = prev_map.pop
+    price_of = _price_of
+    new_append = new.append
+    changed_append = changed.append
+
+    # new + changed i ett enda svep: matchade nycklar plockas ur prev_map,
+    # så det som blir kvar är removed (ingen andra loop med uppslag i cur_map)
     for k, cur in cur_map.items():
-        prev = prev_map.get(k)
+        prev = prev_pop(k, None)
         if prev is None:
-            new.append(cur)
+            new_append(cur)
             continue
 
-        cur_price = _price_of(cur)
-        prev_price = _price_of(prev)
+        cur_price = price_of(cur)
+        prev_price = price_of(prev)
         # Om någon av priserna saknas – betrakta som changed om raderna inte är identiska
+        # (dict-jämförelse direkt – ingen JSON-serialisering per radpar)
         if cur_price is None or prev_price is None:
-            if json.dumps(cur, sort_keys=True) != json.dumps(prev, sort_keys=True):
-                changed.append({"before": prev, "after": cur, "delta": None})
+            if cur != prev:
+                changed_append({"before": prev, "after": cur, "delta": None})
         else:
             if abs(cur_price - prev_price) > 1e-9:
-                changed.append({"before": prev, "after": cur, "delta": cur_price - prev_price})
+                changed_append({"before": prev, "after": cur, "delta": cur_price - prev_price})
 
-    # removed
-    for k, prev in prev_map.items():
-        if k not in cur_map:
-            removed.append(prev)
+    # removed = allt i prev_map som inte matchades ovan (behåller ordningen)
+    removed.extend(prev_map.values())
 
     return {
         "changed": changed,